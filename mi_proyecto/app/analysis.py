@@ -0,0 +1,278 @@
+import pandas as pd
+
+import lots
+import rollups
+
+# Motor de agregación por símbolo.
+# Calcula en una sola pasada (groupby) las métricas que antes se obtenían
+# recorriendo el DataFrame una vez por cada símbolo.
+
+# Incrementar cuando cambie cualquier cálculo o el formato de los
+# resultados para invalidar la caché
+ANALYSIS_VERSION = 6
+
+
+def _to_float(column):
+    return pd.to_numeric(column, errors='coerce')
+
+
+def date_column(data):
+    # La ingesta ya entrega Date como datetime; sólo se convierte si no
+    if 'Date' not in data.columns:
+        return None
+    if pd.api.types.is_datetime64_any_dtype(data['Date']):
+        return data['Date']
+    return pd.to_datetime(data['Date'], errors='coerce', utc=True)
+
+
+def sniff_dates(data, sample_size=100):
+    # Detección genérica para exportaciones sin columna Date conocida: se
+    # prueba una muestra de cada columna de texto antes de convertirla entera
+    for column in data.columns:
+        if data[column].dtype != 'object':
+            continue
+        sample = data[column].dropna().head(sample_size)
+        if pd.to_datetime(sample, errors='coerce', utc=True).isna().all():
+            continue
+        parsed = pd.to_datetime(data[column], errors='coerce', utc=True).dropna()
+        if not parsed.empty:
+            return parsed
+    return None
+
+
+def _plain_index(obj):
+    # Índice de texto normal: los índices categóricos no se pueden combinar
+    # entre bloques con categorías distintas
+    obj.index = pd.Index(obj.index.tolist(), dtype=object)
+    return obj
+
+
+def equity_partial(data, date_mask=None):
+    columns = ['date', 'count', 'income', 'total_sum']
+    if 'Instrument Type' not in data.columns:
+        return pd.DataFrame(columns=columns)
+
+    mask = data['Instrument Type'] == 'Equity'
+    if date_mask is not None:
+        mask &= date_mask
+    equity = data.loc[mask, ['Symbol', 'Date', 'Quantity', 'Average Price']]
+
+    # Las filas con cantidad o precio no numéricos se descartan (antes: ValueError)
+    quantity = _to_float(equity['Quantity'])
+    average_price = _to_float(equity['Average Price'])
+    valid = (quantity.notna() | equity['Quantity'].isna()) & (average_price.notna() | equity['Average Price'].isna())
+    quantity = quantity[valid].fillna(0.0)
+    income = quantity * average_price[valid].fillna(0.0)
+
+    frame = pd.DataFrame({
+        'Symbol': equity.loc[valid, 'Symbol'],
+        'date': equity.loc[valid, 'Date'],
+        'quantity': quantity,
+        'income': income,
+        'total_sum': quantity + income,
+    })
+    grouped = frame.groupby('Symbol', sort=False, observed=True)
+    table = pd.DataFrame({
+        'date': grouped['date'].first(),
+        'count': grouped.size(),
+        'income': grouped['income'].sum(),
+        'total_sum': grouped['total_sum'].sum(),
+    })
+    return _plain_index(table[columns])
+
+
+def finish_equity(partial, stock):
+    columns = ['date', 'count', 'stock', 'income', 'total_sum']
+    table = partial.copy()
+    table['count'] = table['count'].astype(int)
+    # Balance de acciones: Buy to Open - Sell to Close sobre todo el archivo
+    table['stock'] = stock.reindex(table.index, fill_value=0.0)
+    return table[columns]
+
+
+def stock_balance(data):
+    trades = data.loc[data['Sub Type'].isin(['Buy to Open', 'Sell to Close']), ['Symbol', 'Sub Type', 'Quantity']]
+    quantity = _to_float(trades['Quantity']).fillna(0.0)
+    signed = quantity.where(trades['Sub Type'] == 'Buy to Open', -quantity)
+    return _plain_index(signed.groupby(trades['Symbol'], sort=False, observed=True).sum())
+
+
+def dividends_by_symbol(data):
+    if not {'Sub Type', 'Symbol', 'Value'}.issubset(data.columns):
+        return {}
+    dividends = data[data['Sub Type'] == 'Dividend']
+    values = _to_float(dividends['Value']).fillna(0.0)
+    return values.groupby(dividends['Symbol'], sort=False, observed=True).sum().to_dict()
+
+
+def underlying_partial(data):
+    columns = ['date', 'count', 'value', 'quantity', 'dollar']
+    underlying = data['Underlying Symbol']
+    symbols = pd.Index(underlying.dropna().unique().tolist(), dtype=object)
+    if symbols.empty:
+        return pd.DataFrame(columns=columns)
+
+    value = _to_float(data['Value']).fillna(0.0)
+    quantity = _to_float(data['Quantity']).fillna(0.0)
+
+    table = pd.DataFrame(index=symbols)
+    table['count'] = underlying.value_counts().reindex(symbols, fill_value=0)
+    table['value'] = value.groupby(underlying, observed=True).sum().reindex(symbols, fill_value=0.0)
+    table['quantity'] = quantity.groupby(underlying, observed=True).sum().reindex(symbols, fill_value=0.0)
+
+    # Valor en dólares de todo lo que no es Equity (opciones, futuros...)
+    not_equity = data['Instrument Type'] != 'Equity'
+    table['dollar'] = value[not_equity].groupby(underlying[not_equity], observed=True).sum().reindex(symbols, fill_value=0.0)
+    first_rows = data.loc[not_equity & underlying.notna(), ['Underlying Symbol', 'Date']].drop_duplicates('Underlying Symbol')
+    table['date'] = first_rows.set_index('Underlying Symbol')['Date'].reindex(symbols)
+    return table[columns]
+
+
+def finish_underlying(partial, pl):
+    columns = ['date', 'count', 'value', 'quantity', 'global_value', 'dollar', 'pl']
+    table = partial.copy()
+    table['count'] = table['count'].astype(int)
+    table['quantity'] = table['quantity'].astype(int)
+    table['global_value'] = table['value'] + table['quantity']
+    table['pl'] = pl.reindex(table.index, fill_value=0.0)
+    return table[columns]
+
+
+def option_pl(data):
+    # P/L de opciones: Value * Quantity agrupado por Root Symbol
+    value = _to_float(data['Value']).fillna(0.0)
+    quantity = _to_float(data['Quantity']).fillna(0.0)
+    return _plain_index((value * quantity).groupby(data['Root Symbol'], sort=False, observed=True).sum())
+
+
+def total_deposits(data):
+    return _to_float(data.loc[data['Sub Type'] == 'Deposit', 'Value']).sum()
+
+
+# Agregados parciales.
+# aggregate() resume un bloque de transacciones (un archivo entero, un trozo
+# de un CSV leído por partes o un archivo de una cartera) en tablas por
+# símbolo que se pueden sumar con combine(); finish() calcula a partir de
+# ellas los valores que muestra la vista. Con detail=False no se calculan el
+# resumen diario ni las operaciones para los lotes FIFO: la cartera
+# consolidada sólo usa las tablas por símbolo, y los archivos leídos por
+# partes no los guardan para que la memoria no crezca con el archivo.
+
+def aggregate(data, detail=True):
+    dates = parsed_dates = date_column(data)
+    date_mask = None
+    if dates is not None:
+        date_mask = dates.notna()
+    if dates is None or dates.isna().all():
+        dates = sniff_dates(data)
+
+    num_equity_actions = 0
+    num_equity_options = 0
+    if 'Instrument Type' in data.columns and date_mask is not None:
+        num_equity_actions = int(((data['Instrument Type'] == 'Equity') & date_mask).sum())
+        num_equity_options = int(((data['Instrument Type'] == 'Equity Option') & date_mask).sum())
+
+    aggregates = {
+        'rows': len(data),
+        'first_date': dates.min() if dates is not None else pd.NaT,
+        'last_date': dates.max() if dates is not None else pd.NaT,
+        'num_equity_actions': num_equity_actions,
+        'num_equity_options': num_equity_options,
+        'equity': equity_partial(data, date_mask),
+        'stock': stock_balance(data),
+        'dividends': dividends_by_symbol(data),
+        'underlying': underlying_partial(data),
+        'option_pl': option_pl(data),
+        'deposits': total_deposits(data),
+    }
+    if detail:
+        # Listas de resúmenes diarios y de operaciones por bloque; finish() los une
+        aggregates['daily'] = [rollups.daily(data, parsed_dates)]
+        aggregates['fills'] = [lots.fills(data, parsed_dates)]
+    return aggregates
+
+
+def _combine_tables(total, part):
+    # Suma columna a columna; la fecha es la de la primera aparición
+    if total.empty:
+        return part
+    if part.empty:
+        return total
+    index = total.index.append(part.index[~part.index.isin(total.index)])
+    total, part = total.reindex(index), part.reindex(index)
+    combined = pd.DataFrame(index=index)
+    for column in total.columns:
+        if column == 'date':
+            combined[column] = total[column].where(total[column].notna(), part[column])
+        else:
+            combined[column] = total[column].fillna(0) + part[column].fillna(0)
+    return combined
+
+
+def combine(total, part):
+    if total is None:
+        return part
+    dividends = dict(total['dividends'])
+    for symbol, value in part['dividends'].items():
+        dividends[symbol] = dividends.get(symbol, 0.0) + value
+    combined = {
+        'rows': total['rows'] + part['rows'],
+        'first_date': min([d for d in (total['first_date'], part['first_date']) if not pd.isna(d)], default=pd.NaT),
+        'last_date': max([d for d in (total['last_date'], part['last_date']) if not pd.isna(d)], default=pd.NaT),
+        'num_equity_actions': total['num_equity_actions'] + part['num_equity_actions'],
+        'num_equity_options': total['num_equity_options'] + part['num_equity_options'],
+        'equity': _combine_tables(total['equity'], part['equity']),
+        'stock': total['stock'].add(part['stock'], fill_value=0.0),
+        'dividends': dividends,
+        'underlying': _combine_tables(total['underlying'], part['underlying']),
+        'option_pl': total['option_pl'].add(part['option_pl'], fill_value=0.0),
+        'deposits': total['deposits'] + part['deposits'],
+    }
+    for key in ('daily', 'fills'):
+        if key in total and key in part:
+            combined[key] = total[key] + part[key]
+    return combined
+
+
+def finish(aggregates):
+    first_date, last_date = aggregates['first_date'], aggregates['last_date']
+    dates = [] if pd.isna(first_date) else [first_date, last_date, (last_date - first_date).days]
+    equity = finish_equity(aggregates['equity'], aggregates['stock'])
+    underlying = finish_underlying(aggregates['underlying'], aggregates['option_pl'])
+    # Posiciones y P/L realizado con lotes FIFO (ver lots.py)
+    positions, realized = lots.match(lots.merge(aggregates.get('fills', [])))
+    return {
+        'rows': aggregates['rows'],
+        'dates': dates,
+        'num_equity_actions': aggregates['num_equity_actions'],
+        'num_equity_options': aggregates['num_equity_options'],
+        'equity': equity,
+        'underlying': underlying,
+        'dividends': aggregates['dividends'],
+        'deposits': aggregates['deposits'],
+        'summary': financial_summary(equity, underlying, aggregates['dividends'], aggregates['deposits']),
+        # Sin detalle (archivos leídos por partes) no hay resumen diario ni lotes
+        'detail': 'daily' in aggregates,
+        'daily': rollups.merge(aggregates.get('daily', [])),
+        'positions': positions,
+        'realized': realized,
+    }
+
+
+def financial_summary(equity, underlying, dividends, deposits):
+    # Resumen Financiero a partir de las tablas por símbolo
+    open_positions = equity['stock'] != 0
+    acciones_en_proceso = -equity.loc[open_positions, 'income'].sum()
+    total_dividends = sum(dividends.values())
+    pl_acciones = equity.loc[~open_positions, 'income'].sum()
+    total_opciones_en_proceso = underlying['dollar'].sum()
+    total_pl_opciones = underlying['pl'].sum()
+    efectivo = acciones_en_proceso + total_dividends + pl_acciones + total_opciones_en_proceso + total_pl_opciones - deposits
+    return {
+        'acciones_en_proceso': acciones_en_proceso,
+        'total_dividends': total_dividends,
+        'pl_acciones': pl_acciones,
+        'total_opciones_en_proceso': total_opciones_en_proceso,
+        'total_pl_opciones': total_pl_opciones,
+        'efectivo': efectivo,
+    }
@@ -1,37 +1,118 @@
-from flask import Flask, render_template, request, redirect, url_for, send_file, flash
+from flask import Blueprint, Flask, current_app, render_template, request, redirect, url_for, send_file, flash, abort, jsonify, g
 import os
+import threading
 from werkzeug.utils import secure_filename
-import pandas as pd
-import zipfile
-import io
+import hashlib
+import time
 from datetime import datetime
-import plotly.express as px
-import numpy as np
-from flask_sqlalchemy import SQLAlchemy
+from functools import lru_cache
+from importlib import metadata
+from flask_migrate import Migrate
 from flask_login import LoginManager, login_user, login_required, logout_user, current_user
-from users import db, User, UploadedFile
+from users import db, User, UploadedFile, AnalysisJob
+import database
+import storage
+import summaries
+from cache import ResultCache
+from jobs import JobQueue, is_stale
+from instrumentation import Metrics, server_timing, start_profile, dump_profile, profile_report
+
+# Aplicación web.
+# create_app() crea y configura la aplicación. Los módulos de análisis
+# (pandas, numpy, plotly) no se importan al arrancar sino la primera vez que
+# una vista los usa, así que el login, el registro o la administración no
+# pagan su coste. Con PRELOAD_ANALYTICS=1 se importan en create_app(): con
+# gunicorn y preload_app (ver gunicorn.conf.py) eso ocurre una sola vez en
+# el proceso maestro y los workers comparten esa memoria tras el fork.
 
-app = Flask(__name__)
-app.config['SECRET_KEY'] = 'your_secret_key'
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///site.db'
-app.config['UPLOAD_FOLDER'] = 'uploads/'
-app.config['STATIC_FOLDER'] = 'static/'
 ALLOWED_EXTENSIONS = {'csv'}
 
-db.init_app(app)
-login_manager = LoginManager(app)
-login_manager.login_view = 'login'
+# Módulos que se importan por adelantado con PRELOAD_ANALYTICS
+ANALYTICS_MODULES = ['pandas', 'numpy', 'plotly.express', 'plotly.offline', 'analysis', 'ingest', 'ledger', 'lots',
+                     'portfolio', 'results', 'rollups', 'tables']
+
+migrate = Migrate()
+login_manager = LoginManager()
+login_manager.login_view = 'main.login'
+metrics = Metrics()
+_result_cache_lock = threading.Lock()
+
+# Rutas: el blueprint se registra en cada aplicación que crea create_app();
+# los endpoints son 'main.<nombre de la función>'
+bp = Blueprint('main', __name__)
+
+def create_app(config=None):
+    app = Flask(__name__)
+    app.config['SECRET_KEY'] = 'your_secret_key'
+    app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', database.DEFAULT_DATABASE_URI)
+    app.config['UPLOAD_FOLDER'] = 'uploads/'
+    app.config['STATIC_FOLDER'] = 'static/'
+    app.config['LEDGER_FOLDER'] = 'ledgers/'
+    app.config['RESULT_CACHE_MAX_BYTES'] = 64 * 1024 * 1024
+    app.config['RESULT_CACHE_FOLDER'] = 'cache/'
+    app.config['ANALYSIS_WORKERS'] = 2
+    app.config['ANALYSIS_JOB_TIMEOUT'] = 600
+    app.config['PORTFOLIO_WORKERS'] = None
+    app.config['STREAMING_THRESHOLD_BYTES'] = 50 * 1024 * 1024
+    app.config['STREAMING_CHUNK_ROWS'] = 25000
+    app.config['PROFILE_FOLDER'] = 'profiles/'
+    app.config['ADMIN_PER_PAGE'] = 50
+    # Token para que Prometheus pueda leer /metrics sin iniciar sesión
+    app.config['METRICS_TOKEN'] = os.environ.get('METRICS_TOKEN')
+    app.config['PRELOAD_ANALYTICS'] = os.environ.get('PRELOAD_ANALYTICS') == '1'
+    app.config.update(config or {})
+    # Pool de conexiones con MySQL (ver database.py); SQLite no lo usa
+    app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', database.engine_options(
+        app.config['SQLALCHEMY_DATABASE_URI'],
+        pool_size=int(os.environ.get('DB_POOL_SIZE', 5)),
+        max_overflow=int(os.environ.get('DB_MAX_OVERFLOW', 10)),
+        pool_recycle=int(os.environ.get('DB_POOL_RECYCLE', 280)),
+    ))
+
+    db.init_app(app)
+    migrate.init_app(app, db)
+    login_manager.init_app(app)
+    app.extensions['job_queue'] = JobQueue(max_workers=app.config['ANALYSIS_WORKERS'])
+
+    # Crear carpetas si no existen
+    for folder in ('UPLOAD_FOLDER', 'STATIC_FOLDER', 'LEDGER_FOLDER', 'RESULT_CACHE_FOLDER'):
+        os.makedirs(app.config[folder], exist_ok=True)
+
+    app.jinja_env.filters['format_currency'] = format_currency
+    app.jinja_env.filters['format_date'] = format_date
+    app.jinja_env.filters['abs'] = absolute_value
+    app.before_request(start_request_timing)
+    app.after_request(add_server_timing)
+    app.context_processor(inject_plotly_version)
+    app.register_blueprint(bp)
+
+    if app.config['PRELOAD_ANALYTICS']:
+        with metrics.stage('preload'):
+            preload_analytics()
+    return app
+
+def preload_analytics():
+    import importlib
+    for name in ANALYTICS_MODULES:
+        importlib.import_module(name)
+
+# Caché de resultados de la aplicación; se crea al usarla por primera vez
+# porque su clave incluye la versión del análisis (que importa pandas)
+def get_result_cache():
+    cache = current_app.extensions.get('result_cache')
+    if cache is None:
+        with _result_cache_lock:
+            cache = current_app.extensions.get('result_cache')
+            if cache is None:
+                import analysis
+                cache = ResultCache(analysis.ANALYSIS_VERSION, max_bytes=current_app.config['RESULT_CACHE_MAX_BYTES'], directory=current_app.config['RESULT_CACHE_FOLDER'])
+                current_app.extensions['result_cache'] = cache
+    return cache
 
 @login_manager.user_loader
 def load_user(user_id):
     return User.query.get(int(user_id))
 
-# Crear carpetas si no existen
-if not os.path.exists(app.config['UPLOAD_FOLDER']):
-    os.makedirs(app.config['UPLOAD_FOLDER'])
-if not os.path.exists(app.config['STATIC_FOLDER']):
-    os.makedirs(app.config['STATIC_FOLDER'])
-
 # Funciones de ayuda
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
@@ -43,20 +124,56 @@ def format_currency(value):
         return "({:,.2f})".format(abs(value))
     return "{:,.2f}".format(value)
 
-app.jinja_env.filters['format_currency'] = format_currency
+def format_date(value):
+    import pandas as pd
+    if value is None or pd.isna(value):
+        return ""
+    return value.strftime('%Y-%m-%d')
 
 def absolute_value(value):
     return abs(value)
 
-app.jinja_env.filters['abs'] = absolute_value
+# Tiempo de cada petición y perfil de cProfile para los administradores (?profile=1)
+def start_request_timing():
+    g.request_started = time.perf_counter()
+    if request.args.get('profile') and current_user.is_authenticated and current_user.role == 'admin':
+        g.profile = start_profile()
+
+def add_server_timing(response):
+    started = g.pop('request_started', None)
+    if started is None:
+        return response
+    total = time.perf_counter() - started
+    metrics.observe_request(request.endpoint or 'unknown', total)
+    profile = g.pop('profile', None)
+    if profile is not None:
+        path = dump_profile(profile, current_app.config['PROFILE_FOLDER'], request.endpoint or 'request')
+        # Con ?profile=text se devuelve el informe en lugar de la página
+        if request.args.get('profile') == 'text':
+            response = current_app.response_class(profile_report(path), mimetype='text/plain')
+        response.headers['X-Profile'] = os.path.basename(path)
+    response.headers['Server-Timing'] = server_timing(g.get('stage_timings', []), total)
+    return response
+
+# Versión de plotly para las plantillas, sin importar el paquete
+@lru_cache(maxsize=None)
+def plotly_version():
+    return metadata.version('plotly')
+
+def inject_plotly_version():
+    return {'plotly_version': plotly_version()}
 
 # Ruta para la página principal
-@app.route('/')
+@bp.route('/')
 def index():
-    return render_template('index.html')
+    totals, top_symbols = None, []
+    if current_user.is_authenticated:
+        totals = summaries.totals(current_user.id)
+        top_symbols = summaries.top_symbols(current_user.id)
+    return render_template('index.html', totals=totals, top_symbols=top_symbols)
 
 # Ruta para el registro de usuarios
-@app.route('/register', methods=['GET', 'POST'])
+@bp.route('/register', methods=['GET', 'POST'])
 def register():
     if request.method == 'POST':
         username = request.form['username']
@@ -68,13 +185,13 @@ def register():
             db.session.add(user)
             db.session.commit()
             flash('User successfully registered.')
-            return redirect(url_for('login'))
+            return redirect(url_for('main.login'))
         else:
             flash('User already exists.')
     return render_template('register.html')
 
 # Ruta para el login de usuarios
-@app.route('/login', methods=['GET', 'POST'])
+@bp.route('/login', methods=['GET', 'POST'])
 def login():
     if request.method == 'POST':
         username = request.form['username']
@@ -83,36 +200,36 @@ def login():
         if user and user.check_password(password):
             login_user(user)
             flash('Logged in successfully.')
-            return redirect(url_for('index'))
+            return redirect(url_for('main.index'))
         else:
             flash('Invalid username or password.')
     return render_template('login.html')
 
 # Ruta para el logout de usuarios
-@app.route('/logout')
+@bp.route('/logout')
 @login_required
 def logout():
     logout_user()
     flash('Logged out successfully.')
-    return redirect(url_for('login'))
+    return redirect(url_for('main.login'))
 
 # Ruta para la administración de usuarios
-@app.route('/admin')
+@bp.route('/admin')
 @login_required
 def admin():
     if current_user.role != 'admin':
         flash('Access denied.')
-        return redirect(url_for('index'))
-    users = User.query.all()
-    return render_template('admin.html', users=users)
+        return redirect(url_for('main.index'))
+    page = User.query.order_by(User.id).paginate(page=request.args.get('page', 1, type=int), per_page=current_app.config['ADMIN_PER_PAGE'], error_out=False)
+    return render_template('admin.html', users=page.items, pagination=page)
 
 # Ruta para eliminar usuarios
-@app.route('/delete_user/<int:user_id>', methods=['POST'])
+@bp.route('/delete_user/<int:user_id>', methods=['POST'])
 @login_required
 def delete_user(user_id):
     if current_user.role != 'admin':
         flash('Access denied.')
-        return redirect(url_for('index'))
+        return redirect(url_for('main.index'))
     user = User.query.get(user_id)
     if user:
         db.session.delete(user)
@@ -120,166 +237,124 @@ def delete_user(user_id):
         flash('User deleted successfully.')
     else:
         flash('User not found.')
-    return redirect(url_for('admin'))
+    return redirect(url_for('main.admin'))
 
 # Ruta para ver los archivos subidos
-@app.route('/admin_files')
+@bp.route('/admin_files')
 @login_required
 def admin_files():
     if current_user.role != 'admin':
         flash('Access denied.')
-        return redirect(url_for('index'))
-    files = UploadedFile.query.all()
-    return render_template('admin_files.html', files=files)
+        return redirect(url_for('main.index'))
+    page, files = summaries.files_page(request.args.get('page', 1, type=int), current_app.config['ADMIN_PER_PAGE'])
+    return render_template('admin_files.html', files=files, pagination=page, totals=summaries.totals())
+
+# Ruta para el análisis consolidado de varios archivos
+@bp.route('/admin_files/analyze', methods=['POST'])
+@login_required
+def analyze_files():
+    if current_user.role != 'admin':
+        flash('Access denied.')
+        return redirect(url_for('main.index'))
+    file_ids = request.form.getlist('file_ids', type=int)
+    files = UploadedFile.query.filter(UploadedFile.id.in_(file_ids)).all() if file_ids else []
+    # Cada fila seleccionada con su propio contenido, no el último subido con
+    # ese nombre; el mismo contenido seleccionado dos veces cuenta una vez
+    names = {}
+    for file in files:
+        path = stored_path(file)
+        if path:
+            names.setdefault(path, file.filename)
+    file_paths = sorted(names)
+    if not file_paths:
+        flash('No files selected.')
+        return redirect(url_for('main.admin_files'))
+    # El análisis se hace en la cola de trabajos y no en la petición
+    file_names = [names[path] for path in file_paths]
+    job = AnalysisJob(filename=', '.join(file_names)[:255], user_id=current_user.id, portfolio=True, created_at=datetime.utcnow())
+    db.session.add(job)
+    db.session.commit()
+    current_app.extensions['job_queue'].submit(current_app._get_current_object(), job.id, run_portfolio, file_paths, file_names, job.id)
+    return redirect(url_for('main.portfolio_report', job_id=job.id))
+
+# Trabajo en segundo plano del análisis consolidado: el informe se guarda
+# en la caché de resultados con el número de trabajo como clave
+def run_portfolio(file_paths, names, job_id, progress=None):
+    import portfolio
+    if progress is not None:
+        progress(10, 'reading {} files'.format(len(file_paths)))
+    try:
+        report = portfolio.analyze(file_paths, max_workers=current_app.config['PORTFOLIO_WORKERS'],
+                                   streaming_threshold=current_app.config['STREAMING_THRESHOLD_BYTES'], chunk_rows=current_app.config['STREAMING_CHUNK_ROWS'],
+                                   names=names)
+    except ValueError as e:
+        return str(e)
+    get_result_cache().set(get_result_cache().key('portfolio', job_id), report)
+    return None
+
+# Informe consolidado; mientras el trabajo no termina se muestra su progreso
+@bp.route('/admin_files/portfolio/<int:job_id>')
+@login_required
+def portfolio_report(job_id):
+    if current_user.role != 'admin':
+        flash('Access denied.')
+        return redirect(url_for('main.index'))
+    job = AnalysisJob.query.get(job_id)
+    if job is None or not job.portfolio:
+        abort(404)
+    if job.status in ('pending', 'running') and not is_stale(job, current_app.config['ANALYSIS_JOB_TIMEOUT']):
+        return render_template('processing.html', filename=job.filename, job=job)
+    if job.status == 'error':
+        return f"Error processing files: {job.error}"
+    report = get_result_cache().get(get_result_cache().key('portfolio', job.id))
+    if report is None:
+        flash('The consolidated report is no longer available, please run it again.')
+        return redirect(url_for('main.admin_files'))
+    return render_template('portfolio.html', report=report)
 
 # Función para procesar el archivo CSV
-def process_csv(file_path):
+# Devuelve un AnalysisResults; si el archivo no se puede analizar lanza
+# ValueError con el mensaje que se muestra al usuario
+def process_csv(file_path, progress=None):
+    import analysis
+    import ingest
+    from results import AnalysisResults
+    report = progress or (lambda percent, stage: None)
     try:
-        data = pd.read_csv(file_path)
-        data = data.replace({np.nan: None})
+        # Los archivos muy grandes se leen por partes para limitar la memoria;
+        # sin resumen diario ni lotes FIFO, que crecen con el archivo
+        if os.path.getsize(file_path) > current_app.config['STREAMING_THRESHOLD_BYTES']:
+            aggregates = None
+            chunks = ingest.iter_chunks(file_path, current_app.config['STREAMING_CHUNK_ROWS'])
+            while True:
+                with metrics.stage('parse') as timing:
+                    chunk = next(chunks, None)
+                    timing.rows = 0 if chunk is None else len(chunk)
+                if chunk is None:
+                    break
+                with metrics.stage('aggregate', rows=len(chunk)):
+                    aggregates = analysis.combine(aggregates, analysis.aggregate(chunk, detail=False))
+                report(30, f"parsed {aggregates['rows']} rows")
+        else:
+            with metrics.stage('parse') as timing:
+                data = ingest.load(file_path)
+                timing.rows = len(data)
+            report(30, 'parsed')
+            with metrics.stage('aggregate', rows=len(data)):
+                aggregates = analysis.aggregate(data)
     except Exception as e:
-        return None, str(e), 0, 0, {}, {}, {}, {}, {}, [], {}, {}, {}
-
-    dates = []
-    num_equity_actions = 0
-    num_equity_options = 0
-    symbol_counts = {}
-    symbol_total_stock = {}
-    symbol_total_income = {}
-    symbol_total_sum = {}
-    symbol_dividends = {}
-    symbol_dates = {}
-    underlying_symbol_dates = {}
-    
-    for column in data.columns:
-        if data[column].dtype == 'object':
-            try:
-                date_column = pd.to_datetime(data[column], errors='coerce')
-                date_column = date_column.dropna()
-                if not date_column.empty:
-                    sorted_dates = sorted(date_column)
-                    first_date = sorted_dates[0]
-                    last_date = sorted_dates[-1]
-                    total_days = (last_date - first_date).days
-                    if total_days < 0:
-                        total_days = abs(total_days)
-                    dates.append(first_date)
-                    dates.append(last_date)
-                    dates.append(total_days)
-            except ValueError:
-                pass
-                
-    if 'Sub Type' in data.columns and 'Symbol' in data.columns and 'Value' in data.columns:
-        dividends_data = data[data['Sub Type'] == 'Dividend']
-        for _, row in dividends_data.iterrows():
-            symbol = row['Symbol']
-            value = float(row['Value']) if row['Value'] is not None else 0.0
-            if symbol in symbol_dividends:
-                symbol_dividends[symbol] += value
-            else:
-                symbol_dividends[symbol] = value
-
-    if 'Instrument Type' in data.columns:
-        equity_data = data[(data['Instrument Type'] == 'Equity') & (pd.to_datetime(data['Date']) >= dates[0]) & (pd.to_datetime(data['Date']) <= dates[1])]
-        num_equity_actions = equity_data.shape[0]
-        equity_option_data = data[(data['Instrument Type'] == 'Equity Option') & (pd.to_datetime(data['Date']) >= dates[0]) & (pd.to_datetime(data['Date']) <= dates[1])]
-        num_equity_options = equity_option_data.shape[0]
-        for _, row in equity_data.iterrows():
-            symbol = row['Symbol']
-            date = row['Date']
-            try:
-                quantity = float(row['Quantity']) if row['Quantity'] is not None else 0.0
-                average_price = float(row['Average Price']) if row['Average Price'] is not None else 0.0
-                income = quantity * average_price
-                if symbol in symbol_counts:
-                    symbol_counts[symbol] += 1
-                    if symbol in symbol_total_stock:
-                        symbol_total_stock[symbol] += quantity
-                    else:
-                        symbol_total_stock[symbol] = quantity
-                    if symbol in symbol_total_income:
-                        symbol_total_income[symbol] += income
-                    else:
-                        symbol_total_income[symbol] = income
-                    symbol_total_sum[symbol] += (quantity + income)
-                else:
-                    symbol_counts[symbol] = 1
-                    symbol_total_stock[symbol] = quantity
-                    symbol_total_income[symbol] = income
-                    symbol_total_sum[symbol] = quantity + income
-                if symbol not in symbol_dates:
-                    symbol_dates[symbol] = date
-            except ValueError:
-                pass
-
-    for symbol in symbol_counts:
-        buy_to_open = data.loc[(data['Symbol'] == symbol) & (data['Sub Type'] == 'Buy to Open'), 'Quantity'].sum()
-        sell_to_close = data.loc[(data['Symbol'] == symbol) & (data['Sub Type'] == 'Sell to Close'), 'Quantity'].sum()
-        symbol_total_stock[symbol] = buy_to_open - sell_to_close
-    
-    total_income_sum = sum(symbol_total_income.values())
-    total_dividends_sum = sum(symbol_dividends.values())
-    
-    underlying_symbols = data['Underlying Symbol'].dropna().unique().tolist()
-    underlying_symbol_counts = data['Underlying Symbol'].value_counts().to_dict()
-    
-    data['Value'] = pd.to_numeric(data['Value'], errors='coerce').fillna(0)
-    underlying_symbol_values = {symbol: data.loc[(data['Underlying Symbol'] == symbol) & (data['Value'] != 0), 'Value'].sum() for symbol in underlying_symbols}
-    
-    data['Quantity'] = pd.to_numeric(data['Quantity'], errors='coerce').fillna(0)
-    underlying_symbol_quantities = {symbol: int(data.loc[(data['Underlying Symbol'] == symbol) & (data['Quantity'] != 0), 'Quantity'].sum()) for symbol in underlying_symbols}
-    
-    underlying_symbol_global_values = {symbol: underlying_symbol_values[symbol] + underlying_symbol_quantities[symbol] for symbol in underlying_symbols}
-    
-    total_dollar_values = {}
-    for symbol in underlying_symbols:
-        mask = (data['Underlying Symbol'] == symbol) & (data['Instrument Type'] != 'Equity')
-        total_dollar_values[symbol] = data.loc[mask, 'Value'].sum()
-        if symbol not in underlying_symbol_dates:
-            underlying_symbol_dates[symbol] = data.loc[mask, 'Date'].iloc[0]
-
-    total_value_sum = sum(value for value in underlying_symbol_values.values() if value != 0)
-    total_quantity_sum = sum(quantity for quantity in underlying_symbol_quantities.values() if quantity != 0)
-
-    total_global_value_sum = sum(underlying_symbol_global_values.values())
-    total_total_dollar_sum = sum(total_dollar_values.values())
-    
-    total_deposits = data.loc[data['Sub Type'] == 'Deposit', 'Value'].sum()
-
-    acciones_en_proceso = -sum([symbol_total_income[symbol] for symbol in symbol_total_stock if symbol_total_stock[symbol] != 0])
-
-    total_dividends = sum(symbol_dividends.values())
-
-    pl_acciones = sum([symbol_total_income[symbol] for symbol in symbol_total_stock if symbol_total_stock[symbol] == 0])
-
-    pl_values = {}
-    for symbol in underlying_symbols:
-        mask = (data['Root Symbol'] == symbol) & (data['Root Symbol'] != 0)
-        pl_values[symbol] = (data.loc[mask, 'Value'] * data.loc[mask, 'Quantity']).sum()
-    
-    total_pl_2_sum = sum(pl_values.values())
-
-    total_opciones_en_proceso = sum(total_dollar_values.values())
-
-    total_pl_opciones = sum(pl_values.values())
-
-    efectivo = acciones_en_proceso + total_dividends + pl_acciones + total_opciones_en_proceso + total_pl_opciones - total_deposits
-
-    resumen_financiero = {
-        "Acciones en Proceso": abs(acciones_en_proceso),
-        "Total Dividendos": abs(total_dividends),
-        "P/L Acciones": abs(pl_acciones),
-        "Opciones En Proceso": abs(total_opciones_en_proceso),
-        "P/L Opciones": abs(total_pl_opciones),
-        "Efectivo": abs(efectivo)
-    }
-
-    pie_chart_path_resumen = os.path.join(app.config['STATIC_FOLDER'], 'resumen_financiero_pie_chart.html')
-    create_pie_chart(resumen_financiero, pie_chart_path_resumen, title="Resumen Financiero")
-    
-    return data, dates, num_equity_actions, num_equity_options, symbol_counts, symbol_total_stock, symbol_total_income, symbol_total_sum, symbol_dividends, total_income_sum, total_dividends_sum, symbol_dates, underlying_symbols, underlying_symbol_counts, underlying_symbol_values, underlying_symbol_quantities, underlying_symbol_global_values, total_value_sum, total_quantity_sum, total_dollar_values, total_global_value_sum, total_total_dollar_sum, total_deposits, acciones_en_proceso, total_dividends, pl_acciones, pl_values, total_pl_2_sum, total_opciones_en_proceso, total_pl_opciones, efectivo, underlying_symbol_dates
-
-def create_pie_chart(data, output_path, title=""):
+        raise ValueError(str(e)) from e
+    if aggregates is None:
+        raise ValueError("Empty file")
+    report(60, 'aggregated')
+
+    with metrics.stage('finish', rows=aggregates['rows']):
+        results = AnalysisResults.from_aggregates(aggregates)
+    report(80, 'summary')
+    return results
+
+def create_pie_chart(data, title=""):
+    import plotly.express as px
     labels = list(data.keys())
     sizes = [abs(value) for value in data.values()]
     num_colors = len(labels)
@@ -287,16 +362,33 @@ def create_pie_chart(data, output_path, title=""):
     
     fig = px.pie(values=sizes, names=labels, title=title, hole=0.3)
     fig.update_traces(marker=dict(colors=colors), textinfo='percent+label', pull=[0.1 if v == max(sizes) else 0 for v in sizes])
-    fig.write_html(output_path)
+    return fig
+
+def create_time_series_chart(series, title=""):
+    import plotly.express as px
+    fig = px.bar(x=series.index, y=series.values, title=title, labels={'x': 'Date', 'y': 'USD'})
+    fig.update_traces(marker_color='rgba(0,123,255,0.6)')
+    return fig
+
+def resumen_financiero(results):
+    summary = results.summary
+    return {
+        "Acciones en Proceso": abs(summary['acciones_en_proceso']),
+        "Total Dividendos": abs(summary['total_dividends']),
+        "P/L Acciones": abs(summary['pl_acciones']),
+        "Opciones En Proceso": abs(summary['total_opciones_en_proceso']),
+        "P/L Opciones": abs(summary['total_pl_opciones']),
+        "Efectivo": abs(summary['efectivo'])
+    }
 
-def get_equity_symbols(data):
-    if 'Symbol' in data.columns and 'Instrument Type' in data.columns:
-        equity_symbols = data[data['Instrument Type'] == 'Equity']['Symbol'].unique().tolist()
-        return equity_symbols
-    return []
+# Gráficos disponibles: nombre -> (título, función que extrae los datos de los resultados)
+CHARTS = {
+    'resumen': ("Resumen Financiero", resumen_financiero),
+    'dividends': ("Distribution of Dividends by Symbol", lambda results: results.dividends.to_dict()),
+}
 
 # Ruta para la subida de archivos
-@app.route('/upload', methods=['POST'])
+@bp.route('/upload', methods=['POST'])
 @login_required
 def upload_file():
     if 'file' not in request.files:
@@ -306,42 +398,347 @@ def upload_file():
         return redirect(request.url)
     if file and allowed_file(file.filename):
         filename = secure_filename(file.filename)
-        file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        file.save(file_path)
-        
+        # Se guarda por partes calculando el hash; el mismo contenido se guarda una vez
+        file_path, digest, size = storage.save(file.stream, current_app.config['UPLOAD_FOLDER'], current_user.id, filename)
+        get_result_cache().remember(storage.object_path(current_app.config['UPLOAD_FOLDER'], digest), digest)
+
         # Guardar registro del archivo subido
-        uploaded_file = UploadedFile(filename=filename, user_id=current_user.id, upload_date=datetime.utcnow())
+        uploaded_file = UploadedFile(filename=filename, user_id=current_user.id, upload_date=datetime.utcnow(), sha256=digest, size=size)
         db.session.add(uploaded_file)
         db.session.commit()
-        
-        return redirect(url_for('uploaded_file', filename=filename))
+
+        # La lectura, la normalización y, en modo incremental, el historial
+        # se hacen en el trabajo en segundo plano, no en la petición
+        incremental = bool(request.form.get('incremental'))
+        job = start_analysis(file_path, filename, uploaded_file, incremental=incremental)
+        if incremental:
+            return redirect(url_for('main.view_ledger', job=job.id))
+        return redirect(url_for('main.uploaded_file', filename=filename))
     return redirect(request.url)
 
+# Resultados del análisis de un archivo, usando la caché si es posible
+def load_results(file_path, cache_key, progress=None):
+    results = get_result_cache().get(cache_key)
+    if results is None:
+        results = process_csv(file_path, progress)
+        get_result_cache().set(cache_key, results)
+    return results
+
+# Añade al historial del usuario las transacciones nuevas del archivo
+def import_ledger(file_path, user_id):
+    import ingest
+    import ledger
+    folder = ledger.ledger_folder(current_app.config['LEDGER_FOLDER'], user_id)
+    # Los archivos grandes se importan por partes, con todas sus columnas
+    parts = ingest.read_parts(file_path, current_app.config['STREAMING_THRESHOLD_BYTES'], current_app.config['STREAMING_CHUNK_ROWS'], skip_columns=())
+    return ledger.append_chunks(folder, parts)
+
+# Trabajo en segundo plano: deja los resultados en la caché, guarda el
+# resumen del archivo en la base de datos y, si se pidió, actualiza el historial
+def run_analysis(file_path, uploaded_file_id=None, job_id=None, progress=None):
+    uploaded_file = UploadedFile.query.get(uploaded_file_id) if uploaded_file_id is not None else None
+    # El hash guardado al subir el archivo evita volver a leerlo para la caché
+    if uploaded_file is not None and uploaded_file.sha256:
+        cache_key = get_result_cache().key(uploaded_file.sha256)
+    else:
+        cache_key = get_result_cache().key_for(file_path)
+    try:
+        results = load_results(file_path, cache_key, progress)
+    except ValueError as e:
+        return str(e)
+    if uploaded_file is not None:
+        summaries.store(uploaded_file, results)
+    job = AnalysisJob.query.get(job_id) if job_id is not None else None
+    if job is not None and job.incremental:
+        if progress is not None:
+            progress(90, 'history')
+        try:
+            job.ledger_rows = import_ledger(file_path, job.user_id)
+        except ValueError as e:
+            return f'Error updating history: {e}'
+        db.session.commit()
+    return None
+
+# Contenido de una subida: el objeto guardado por su hash (ver storage.py),
+# que no cambia aunque el usuario vuelva a subir otro archivo con el mismo
+# nombre; las subidas anteriores a storage.py no tienen hash
+def stored_path(uploaded_file):
+    folder = current_app.config['UPLOAD_FOLDER']
+    if uploaded_file.sha256:
+        path = storage.object_path(folder, uploaded_file.sha256)
+        return path if os.path.exists(path) else None
+    return storage.find(folder, uploaded_file.user_id, uploaded_file.filename)
+
+def start_analysis(file_path, filename, uploaded_file=None, incremental=False):
+    if uploaded_file is None:
+        uploaded_file = UploadedFile.query.filter_by(filename=filename, user_id=current_user.id).order_by(UploadedFile.id.desc()).first()
+    # El trabajo lee el contenido de esta subida y no el enlace del usuario,
+    # que otra subida con el mismo nombre puede sustituir antes de que empiece
+    if uploaded_file is not None:
+        file_path = stored_path(uploaded_file) or file_path
+    job = AnalysisJob(filename=filename, user_id=current_user.id, uploaded_file=uploaded_file, incremental=incremental, created_at=datetime.utcnow())
+    db.session.add(job)
+    db.session.commit()
+    current_app.extensions['job_queue'].submit(current_app._get_current_object(), job.id, run_analysis, file_path, uploaded_file.id if uploaded_file is not None else None, job.id)
+    return job
+
+# Página de resultados; las tablas por símbolo se cargan desde la API
+def render_results(filename, results, start=None, end=None):
+    import rollups
+    summary = results.summary
+    with metrics.stage('render'):
+        return render_template('uploaded.html', filename=filename, dates=results.dates, num_equity_actions=results.num_equity_actions, num_equity_options=results.num_equity_options, total_income_sum=results.total_income_sum, total_dividends_sum=results.total_dividends_sum, total_pl_2_sum=results.total_pl_2_sum, total_deposits=results.deposits, acciones_en_proceso=summary['acciones_en_proceso'], total_dividends=summary['total_dividends'], pl_acciones=summary['pl_acciones'], total_opciones_en_proceso=summary['total_opciones_en_proceso'], total_pl_opciones=summary['total_pl_opciones'], efectivo=summary['efectivo'], pie_chart_url_resumen=url_for('main.chart_json', filename=filename, chart='resumen'), time_series_charts={metric: (title, url_for('main.timeseries_json', filename=filename, metric=metric)) for metric, (title, _, _) in rollups.METRICS.items()}, start=start, end=end, equity_table_url=url_for('main.table_json', filename=filename, table='equity'), underlying_table_url=url_for('main.table_json', filename=filename, table='underlying'), positions_table_url=url_for('main.table_json', filename=filename, table='positions'), summary_url=url_for('main.summary_json', filename=filename), lot_summary=results.lot_summary, detail=results.detail)
+
+# Rango de fechas opcional (?start=AAAA-MM-DD&end=AAAA-MM-DD) de las vistas
+def date_range_args(args):
+    start, end = args.get('start') or None, args.get('end') or None
+    for value in (start, end):
+        if value is not None:
+            datetime.strptime(value, '%Y-%m-%d')
+    return start, end
+
+# Contenido de la última subida del usuario actual con ese nombre; sin una
+# fila en UploadedFile no se busca nada, tampoco en la raíz de la carpeta
+def upload_path(filename):
+    uploaded_file = UploadedFile.query.filter_by(filename=filename, user_id=current_user.id).order_by(UploadedFile.id.desc()).first()
+    if uploaded_file is None:
+        return None
+    return stored_path(uploaded_file)
+
+# Resultados de un archivo limitados al rango pedido, si lo hay
+def results_between(file_path, cache_key, start, end):
+    try:
+        results = load_results(file_path, cache_key)
+    except ValueError as e:
+        abort(422, f"Error processing file: {e}")
+    if start or end:
+        with metrics.stage('range'):
+            results = results.between(start, end)
+    return results
+
 # Ruta para mostrar los resultados del archivo subido
-@app.route('/uploads/<filename>')
+@bp.route('/uploads/<filename>')
 @login_required
 def uploaded_file(filename):
-    file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-    data, dates, num_equity_actions, num_equity_options, symbol_counts, symbol_total_stock, symbol_total_income, symbol_total_sum, symbol_dividends, total_income_sum, total_dividends_sum, symbol_dates, underlying_symbols, underlying_symbol_counts, underlying_symbol_values, underlying_symbol_quantities, underlying_symbol_global_values, total_value_sum, total_quantity_sum, total_dollar_values, total_global_value_sum, total_total_dollar_sum, total_deposits, acciones_en_proceso, total_dividends, pl_acciones, pl_values, total_pl_2_sum, total_opciones_en_proceso, total_pl_opciones, efectivo, underlying_symbol_dates = process_csv(file_path)
-    if data is None:
-        return f"Error processing file: {dates}"
-    equity_symbols = get_equity_symbols(data)
-    for i in range(2):
-        dates[i] = dates[i].strftime('%Y-%m-%d')
-    
-    pie_chart_path = os.path.join(app.config['STATIC_FOLDER'], 'dividends_pie_chart.html')
-    create_pie_chart(symbol_dividends, pie_chart_path, title="Distribution of Dividends by Symbol")
-
-    return render_template('uploaded.html', filename=filename, dates=dates, num_equity_actions=num_equity_actions, num_equity_options=num_equity_options, symbol_counts=symbol_counts, symbol_total_stock=symbol_total_stock, symbol_total_income=symbol_total_income, symbol_total_sum=symbol_total_sum, equity_symbols=equity_symbols, symbol_dividends=symbol_dividends, pie_chart_url=url_for('static', filename='dividends_pie_chart.html'), total_income_sum=total_income_sum, total_dividends_sum=total_dividends_sum, symbol_dates=symbol_dates, underlying_symbols=underlying_symbols, underlying_symbol_counts=underlying_symbol_counts, underlying_symbol_values=underlying_symbol_values, underlying_symbol_quantities=underlying_symbol_quantities, underlying_symbol_global_values=underlying_symbol_global_values, total_value_sum=total_value_sum, total_quantity_sum=total_quantity_sum, total_dollar_values=total_dollar_values, total_global_value_sum=total_global_value_sum, total_total_dollar_sum=total_total_dollar_sum, total_deposits=total_deposits, acciones_en_proceso=acciones_en_proceso, total_dividends=total_dividends, pl_acciones=pl_acciones, pl_values=pl_values, total_pl_2_sum=total_pl_2_sum, total_opciones_en_proceso=total_opciones_en_proceso, total_pl_opciones=total_pl_opciones, efectivo=efectivo, pie_chart_url_resumen=url_for('static', filename='resumen_financiero_pie_chart.html'), underlying_symbol_dates=underlying_symbol_dates)
+    file_path = upload_path(filename)
+    if file_path is None:
+        abort(404)
+    try:
+        start, end = date_range_args(request.args)
+    except ValueError:
+        abort(400, 'Dates must use the YYYY-MM-DD format')
+    with metrics.stage('cache'):
+        results = get_result_cache().get(get_result_cache().key_for(file_path))
+    if results is None:
+        # Todavía no hay resultados: se muestra el progreso del análisis
+        job = AnalysisJob.query.filter_by(filename=filename, user_id=current_user.id, portfolio=False).order_by(AnalysisJob.id.desc()).first()
+        if job is not None and job.status == 'error':
+            return f"Error processing file: {job.error}"
+        if job is None or job.status == 'done' or is_stale(job, current_app.config['ANALYSIS_JOB_TIMEOUT']):
+            job = start_analysis(file_path, filename)
+        return render_template('processing.html', filename=filename, job=job)
+    if start or end:
+        try:
+            with metrics.stage('range'):
+                results = results.between(start, end)
+        except ValueError as e:
+            abort(400, str(e))
+    return render_results(filename, results, start, end)
+
+# Respuesta JSON con una figura guardada en la caché de resultados.
+# Las figuras se guardan junto al análisis del archivo, así que cada archivo
+# tiene sus propios gráficos y no se escribe nada en disco.
+def cached_figure(figure_key, build):
+    etag = hashlib.sha256(repr(figure_key).encode()).hexdigest()[:32]
+    if request.if_none_match.contains(etag):
+        response = current_app.response_class(status=304)
+    else:
+        with metrics.stage('cache'):
+            figure = get_result_cache().get(figure_key)
+        if figure is None:
+            figure = build()
+            get_result_cache().set(figure_key, figure)
+        response = current_app.response_class(figure, mimetype='application/json')
+    response.set_etag(etag)
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
+
+# Ruta para obtener la figura de un gráfico en JSON
+@bp.route('/uploads/<filename>/charts/<chart>.json')
+@login_required
+def chart_json(filename, chart):
+    if chart not in CHARTS:
+        abort(404)
+    try:
+        start, end = date_range_args(request.args)
+    except ValueError:
+        abort(400, 'Dates must use the YYYY-MM-DD format')
+    file_path = upload_path(filename)
+    cache_key = get_result_cache().key_for(file_path) if file_path is not None else None
+    if cache_key is None:
+        abort(404)
+
+    def build():
+        try:
+            results = results_between(file_path, cache_key, start, end)
+        except ValueError as e:
+            abort(400, str(e))
+        title, extract = CHARTS[chart]
+        with metrics.stage('chart'):
+            return create_pie_chart(extract(results), title=title).to_json()
+
+    return cached_figure(cache_key + ('chart', chart, start, end), build)
+
+# Ruta para obtener una serie temporal (diaria, mensual o anual) en JSON,
+# calculada a partir del resumen diario del archivo
+@bp.route('/uploads/<filename>/timeseries/<metric>.json')
+@login_required
+def timeseries_json(filename, metric):
+    import rollups
+    if metric not in rollups.METRICS:
+        abort(404)
+    freq = request.args.get('freq', 'M')
+    if freq not in rollups.FREQUENCIES:
+        abort(400, f'Unknown frequency: {freq}')
+    try:
+        start, end = date_range_args(request.args)
+    except ValueError:
+        abort(400, 'Dates must use the YYYY-MM-DD format')
+    file_path = upload_path(filename)
+    cache_key = get_result_cache().key_for(file_path) if file_path is not None else None
+    if cache_key is None:
+        abort(404)
+
+    def build():
+        results = results_between(file_path, cache_key, None, None)
+        if not results.detail:
+            # Archivo leído por partes: no tiene resumen diario
+            abort(404)
+        with metrics.stage('chart'):
+            series = results.time_series(metric, freq, start, end)
+            return create_time_series_chart(series, rollups.METRICS[metric][0]).to_json()
+
+    return cached_figure(cache_key + ('timeseries', metric, freq, start, end), build)
+
+# Ruta con el Resumen Financiero del rango pedido en JSON; la página lo
+# usa al cambiar las fechas para mostrar los mismos valores que el gráfico
+@bp.route('/uploads/<filename>/summary.json')
+@login_required
+def summary_json(filename):
+    try:
+        start, end = date_range_args(request.args)
+    except ValueError:
+        abort(400, 'Dates must use the YYYY-MM-DD format')
+    file_path = upload_path(filename)
+    cache_key = get_result_cache().key_for(file_path) if file_path is not None else None
+    if cache_key is None:
+        abort(404)
+    try:
+        results = results_between(file_path, cache_key, start, end)
+    except ValueError:
+        # Ninguna transacción en el rango
+        return jsonify(dict({field: 0.0 for field in summaries.SUMMARY_FIELDS}, deposits=0.0))
+    return jsonify(dict({field: float(value) for field, value in results.summary.items()}, deposits=float(results.deposits)))
+
+# Ruta de la API con las tablas por símbolo, filtradas, ordenadas y paginadas
+@bp.route('/uploads/<filename>/tables/<table>.json')
+@login_required
+def table_json(filename, table):
+    import tables
+    if table not in tables.TABLES:
+        abort(404)
+    try:
+        params = tables.parse_query(table, request.args)
+    except ValueError as e:
+        abort(400, str(e))
+    start, end = params.pop('start'), params.pop('end')
+    file_path = upload_path(filename)
+    cache_key = get_result_cache().key_for(file_path) if file_path is not None else None
+    if cache_key is None:
+        abort(404)
+    rows_key = cache_key + ('table', table, start, end)
+    with metrics.stage('cache'):
+        rows = get_result_cache().get(rows_key)
+    if rows is None:
+        try:
+            rows = tables.build_rows(results_between(file_path, cache_key, start, end), table)
+        except ValueError:
+            # Ninguna transacción en el rango
+            rows = []
+        get_result_cache().set(rows_key, rows)
+    with metrics.stage('query', rows=len(rows)):
+        page = tables.query(rows, table, **params)
+    return jsonify(page)
+
+# Ruta para servir plotly.js desde la aplicación, una sola vez por navegador
+@bp.route('/plotly.min.js')
+def plotly_js():
+    from plotly.offline import get_plotlyjs
+    response = current_app.response_class(get_plotlyjs(), mimetype='application/javascript')
+    response.set_etag(plotly_version())
+    response.cache_control.public = True
+    response.cache_control.max_age = 365 * 24 * 3600
+    return response.make_conditional(request)
+
+# Ruta con las métricas de las etapas en formato Prometheus
+@bp.route('/metrics')
+def metrics_endpoint():
+    token = current_app.config['METRICS_TOKEN']
+    authorized = token and request.headers.get('Authorization') == f'Bearer {token}'
+    if not authorized and not (current_user.is_authenticated and current_user.role == 'admin'):
+        abort(403)
+    return current_app.response_class(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+# Ruta para consultar el estado de un análisis en segundo plano
+@bp.route('/jobs/<int:job_id>')
+@login_required
+def job_status(job_id):
+    job = AnalysisJob.query.get(job_id)
+    if job is None or (job.user_id != current_user.id and current_user.role != 'admin'):
+        abort(404)
+    if job.portfolio:
+        result_url = url_for('main.portfolio_report', job_id=job.id)
+    elif job.incremental:
+        result_url = url_for('main.view_ledger', job=job.id)
+    else:
+        result_url = url_for('main.uploaded_file', filename=job.filename)
+    return jsonify(id=job.id, filename=job.filename, status=job.status, progress=job.progress, stage=job.stage, error=job.error, result_url=result_url)
 
-# Ruta para la descarga de archivos
-@app.route('/download/<filename>')
+# Ruta para ver el historial acumulado del usuario
+@bp.route('/ledger')
+@login_required
+def view_ledger():
+    import ledger
+    # ?job=: importación incremental lanzada al subir un archivo
+    job = AnalysisJob.query.get(request.args.get('job', type=int) or 0)
+    if job is not None and job.user_id == current_user.id:
+        if job.status in ('pending', 'running') and not is_stale(job, current_app.config['ANALYSIS_JOB_TIMEOUT']):
+            return render_template('processing.html', filename=job.filename, job=job)
+        if job.status == 'error':
+            flash(job.error)
+        elif job.ledger_rows is not None:
+            flash(f'{job.ledger_rows} new transactions added to your history.')
+    summary = ledger.load_summary(ledger.ledger_folder(current_app.config['LEDGER_FOLDER'], current_user.id))
+    return render_template('ledger.html', summary=summary)
+
+# Ruta para la descarga de archivos; los administradores pueden descargar
+# una subida concreta de cualquier usuario con ?file_id=
+@bp.route('/download/<filename>')
 @login_required
 def download_csv(filename):
-    file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+    file_id = request.args.get('file_id', type=int) if current_user.role == 'admin' else None
+    if file_id is not None:
+        uploaded_file = UploadedFile.query.get(file_id)
+        file_path = stored_path(uploaded_file) if uploaded_file is not None and uploaded_file.filename == filename else None
+    else:
+        file_path = upload_path(filename)
+    if file_path is None:
+        abort(404)
     return send_file(file_path, as_attachment=True, download_name=filename)
 
 if __name__ == "__main__":
+    app = create_app()
     with app.app_context():
         db.create_all()
 
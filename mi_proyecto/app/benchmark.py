@@ -0,0 +1,493 @@
+import argparse
+import itertools
+import json
+import os
+import platform
+import shutil
+import string
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+# Benchmark del análisis con historiales sintéticos de tastytrade.
+# generate_history() crea un CSV con el mismo esquema que la exportación
+# real (fechas, importes con separador de miles, símbolos de opciones...)
+# y run_benchmark() mide el tiempo y el pico de memoria de cada etapa:
+# lectura/normalización, agregación, gráficos, páginas de las tablas y
+# plantilla de resultados. El escenario "admin" mide en cambio las páginas
+# de administración con tantos archivos subidos como indique --rows, y
+# "startup" el arranque de un proceso de la aplicación.
+# Los resultados se guardan en JSON y se pueden comparar con una ejecución
+# anterior para detectar regresiones:
+#
+#   python benchmark.py --rows 10000 100000 --output bench.json
+#   python benchmark.py --rows 10000 100000 --compare bench.json
+#   python benchmark.py --scenario admin --rows 1000 10000 30000
+#   python benchmark.py --scenario startup --rows 1000
+
+COLUMNS = ['Date', 'Type', 'Sub Type', 'Action', 'Symbol', 'Instrument Type', 'Description', 'Value', 'Quantity',
+           'Average Price', 'Commissions', 'Fees', 'Multiplier', 'Root Symbol', 'Underlying Symbol', 'Expiration Date',
+           'Strike Price', 'Call or Put', 'Order #']
+
+DEFAULT_SIZES = [10000, 100000, 1000000]
+
+# Proporción de cada operación dentro de las filas de opciones
+OPTION_SUB_TYPES = {
+    'Sell to Open': 0.35,
+    'Buy to Close': 0.25,
+    'Buy to Open': 0.15,
+    'Sell to Close': 0.1,
+    'Expiration': 0.12,
+    'Assignment': 0.03,
+}
+
+OPTION_ACTIONS = {
+    'Sell to Open': 'SELL_TO_OPEN',
+    'Buy to Close': 'BUY_TO_CLOSE',
+    'Buy to Open': 'BUY_TO_OPEN',
+    'Sell to Close': 'SELL_TO_CLOSE',
+    'Expiration': 'SELL_TO_CLOSE',
+    'Assignment': '',
+}
+
+
+def tickers(count):
+    # AAA, AAB, ... siempre en el mismo orden para que los datos sean reproducibles
+    letters = itertools.product(string.ascii_uppercase, repeat=3)
+    return [''.join(next(letters)) for _ in range(count)]
+
+
+def _money(values):
+    return ['{:,.2f}'.format(value) for value in values]
+
+
+def _order_numbers(rng, count):
+    return rng.integers(100000000, 999999999, size=count).astype(str)
+
+
+def _timestamps(rng, count, start, end):
+    seconds = rng.integers(int(start.timestamp()), int(end.timestamp()), size=count)
+    return pd.to_datetime(seconds, unit='s')
+
+
+def _format_dates(timestamps):
+    # Hora del Pacífico como en las exportaciones: -0700 en verano, -0800 en invierno
+    offsets = np.where((timestamps.month >= 4) & (timestamps.month <= 10), '-0700', '-0800')
+    return timestamps.strftime('%Y-%m-%dT%H:%M:%S').values.astype(object) + offsets
+
+
+def _equity_rows(rng, count, symbols, timestamps):
+    buy = rng.random(count) < 0.55
+    quantity = rng.integers(1, 200, size=count)
+    price = np.round(rng.uniform(5, 500, size=count), 2)
+    value = np.where(buy, -1, 1) * quantity * price
+    symbol = rng.choice(symbols, size=count)
+    verb = np.where(buy, 'Bought', 'Sold')
+    return pd.DataFrame({
+        'Date': timestamps,
+        'Type': 'Trade',
+        'Sub Type': np.where(buy, 'Buy to Open', 'Sell to Close'),
+        'Action': np.where(buy, 'BUY_TO_OPEN', 'SELL_TO_CLOSE'),
+        'Symbol': symbol,
+        'Instrument Type': 'Equity',
+        'Description': ['{} {} {} @ {:.2f}'.format(v, q, s, p) for v, q, s, p in zip(verb, quantity, symbol, price)],
+        'Value': _money(value),
+        'Quantity': quantity.astype(str),
+        'Average Price': ['{:.2f}'.format(v) for v in np.where(buy, -price, price)],
+        'Commissions': '0.00',
+        'Fees': ['{:.2f}'.format(v) for v in -np.round(quantity * 0.0008, 2)],
+        'Multiplier': '',
+        'Root Symbol': '',
+        'Underlying Symbol': '',
+        'Expiration Date': '',
+        'Strike Price': '',
+        'Call or Put': '',
+        'Order #': _order_numbers(rng, count),
+    })
+
+
+def _option_rows(rng, count, symbols, timestamps):
+    sub_types = rng.choice(list(OPTION_SUB_TYPES), size=count, p=list(OPTION_SUB_TYPES.values()))
+    root = rng.choice(symbols, size=count)
+    expiration = (timestamps + pd.to_timedelta(rng.integers(1, 60, size=count), unit='D')).normalize()
+    strike = np.round(rng.uniform(10, 500, size=count) * 2) / 2
+    call = rng.random(count) < 0.5
+    quantity = rng.integers(1, 10, size=count)
+    premium = np.round(rng.uniform(0.05, 20, size=count), 2)
+    removal = np.isin(sub_types, ['Expiration', 'Assignment'])
+    sign = np.where(np.isin(sub_types, ['Sell to Open', 'Sell to Close']), 1, -1)
+    value = np.where(removal, 0.0, sign * premium * 100 * quantity)
+    average_price = np.where(removal, 0.0, sign * premium * 100)
+
+    occ_symbol = ['{:<6}{}{}{:08d}'.format(r, e.strftime('%y%m%d'), 'C' if c else 'P', int(s * 1000))
+                  for r, e, c, s in zip(root, expiration, call, strike)]
+    descriptions = []
+    for sub_type, q, r, e, c, s, p in zip(sub_types, quantity, root, expiration, call, strike, premium):
+        if sub_type == 'Expiration':
+            descriptions.append('Removal of {}.0 {} {} {} {:.2f} due to expiration.'.format(q, r, e.strftime('%m/%d/%y'), 'Call' if c else 'Put', s))
+        elif sub_type == 'Assignment':
+            descriptions.append('Removal of option due to assignment')
+        else:
+            verb = 'Sold' if sub_type.startswith('Sell') else 'Bought'
+            descriptions.append('{} {} {} {} {} {:.2f} @ {:.2f}'.format(verb, q, r, e.strftime('%m/%d/%y'), 'Call' if c else 'Put', s, p))
+
+    return pd.DataFrame({
+        'Date': timestamps,
+        'Type': np.where(removal, 'Receive Deliver', 'Trade'),
+        'Sub Type': sub_types,
+        'Action': [OPTION_ACTIONS[s] for s in sub_types],
+        'Symbol': occ_symbol,
+        'Instrument Type': 'Equity Option',
+        'Description': descriptions,
+        'Value': _money(value),
+        'Quantity': quantity.astype(str),
+        'Average Price': _money(average_price),
+        'Commissions': np.where(removal, '--', ['{:.2f}'.format(v) for v in -np.minimum(quantity, 10) * 1.0]),
+        'Fees': ['{:.3f}'.format(v) for v in np.where(removal, 0.0, -np.round(quantity * 0.14, 3))],
+        'Multiplier': '100',
+        'Root Symbol': root,
+        'Underlying Symbol': root,
+        'Expiration Date': ['{}/{}/{}'.format(e.month, e.day, e.strftime('%y')) for e in expiration],
+        'Strike Price': ['{:g}'.format(s) for s in strike],
+        'Call or Put': np.where(call, 'CALL', 'PUT'),
+        'Order #': np.where(removal, '', _order_numbers(rng, count)),
+    })
+
+
+def _money_movement_rows(rng, count, sub_type, symbols, timestamps):
+    if sub_type == 'Dividend':
+        symbol = rng.choice(symbols, size=count)
+        value = np.round(rng.uniform(0.5, 500, size=count), 2)
+        instrument, description = 'Equity', 'DIVIDEND'
+    else:
+        symbol = ''
+        value = np.round(rng.integers(1, 50, size=count) * 100.0, 2)
+        instrument, description = '', 'ACH DEPOSIT'
+    frame = pd.DataFrame({'Date': timestamps, 'Type': 'Money Movement', 'Sub Type': sub_type, 'Action': '',
+                          'Symbol': symbol, 'Instrument Type': instrument, 'Description': description,
+                          'Value': _money(value), 'Quantity': '0', 'Average Price': '', 'Commissions': '--',
+                          'Fees': '0.00'})
+    return frame.reindex(columns=COLUMNS, fill_value='')
+
+
+def generate_history(rows, symbols=200, option_ratio=0.7, dividend_density=0.02, deposit_density=0.005,
+                     seed=0, start=datetime(2015, 1, 1), end=datetime(2024, 5, 11)):
+    # option_ratio: fracción de las operaciones que son opciones (el resto, acciones)
+    # dividend_density / deposit_density: fracción de filas de dividendos / depósitos
+    rng = np.random.default_rng(seed)
+    names = tickers(symbols)
+    num_dividends = int(rows * dividend_density)
+    num_deposits = max(int(rows * deposit_density), 1)
+    num_trades = max(rows - num_dividends - num_deposits, 0)
+    num_options = int(num_trades * option_ratio)
+    num_equity = num_trades - num_options
+
+    parts = [
+        _equity_rows(rng, num_equity, names, _timestamps(rng, num_equity, start, end)),
+        _option_rows(rng, num_options, names, _timestamps(rng, num_options, start, end)),
+        _money_movement_rows(rng, num_dividends, 'Dividend', names, _timestamps(rng, num_dividends, start, end)),
+        _money_movement_rows(rng, num_deposits, 'Deposit', names, _timestamps(rng, num_deposits, start, end)),
+    ]
+    data = pd.concat(parts, ignore_index=True)[COLUMNS]
+    # Igual que la exportación: de la transacción más reciente a la más antigua
+    data = data.sort_values('Date', ascending=False, kind='mergesort').reset_index(drop=True)
+    data['Date'] = _format_dates(pd.DatetimeIndex(data['Date']))
+    return data
+
+
+def write_history(file_path, rows, **options):
+    generate_history(rows, **options).to_csv(file_path, index=False)
+    return file_path
+
+
+def measure(func, repeat=1):
+    # Mediana del tiempo de `repeat` ejecuciones; el pico de memoria se mide
+    # en una ejecución aparte porque tracemalloc ralentiza el código.
+    # La primera ejecución no se cuenta: incluye importaciones y cachés
+    # (plantillas de Jinja, validadores de plotly)
+    func()
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - started)
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    timings.sort()
+    return {'seconds': timings[len(timings) // 2], 'min_seconds': timings[0], 'peak_mb': peak / 1024 / 1024}
+
+
+def analysis_stages(file_path, repeat=1, rows=None):
+    # Etapas del análisis de un archivo tal y como las ejecuta la aplicación
+    import analysis
+    import ingest
+    import lots
+    import tables
+    import app as webapp
+    from results import AnalysisResults
+
+    stages = {}
+    state = {}
+
+    def parse():
+        state['data'] = ingest.normalize(pd.read_csv(file_path, dtype=ingest.CSV_DTYPES))
+
+    def aggregate():
+        state['results'] = AnalysisResults.from_aggregates(analysis.aggregate(state['data']))
+
+    def lot_matching():
+        # Emparejamiento FIFO por separado (también forma parte de aggregate)
+        data = state['data']
+        lots.match(lots.fills(data, data['Date']))
+
+    stages['parse'] = measure(parse, repeat)
+    stages['aggregate'] = measure(aggregate, repeat)
+    stages['lots'] = measure(lot_matching, repeat)
+
+    # Gráficos y plantilla a partir de los resultados que guarda la caché
+    flask_app = webapp.create_app({'STREAMING_THRESHOLD_BYTES': os.path.getsize(file_path) + 1})
+    with flask_app.app_context():
+        results = webapp.process_csv(file_path)
+
+    def charts():
+        for title, extract in webapp.CHARTS.values():
+            webapp.create_pie_chart(extract(results), title=title).to_json()
+
+    def render():
+        with flask_app.test_request_context():
+            webapp.render_results(os.path.basename(file_path), results)
+
+    def table_pages():
+        # Primera página de cada tabla, como la pide la página al cargarse
+        for name in tables.TABLES:
+            tables.query(tables.build_rows(results, name), name)
+
+    stages['chart'] = measure(charts, repeat)
+    stages['tables'] = measure(table_pages, repeat)
+    stages['render'] = measure(render, repeat)
+    stages['_info'] = {'equity_symbols': len(results.equity), 'underlying_symbols': len(results.underlying),
+                       'positions': len(results.positions)}
+    return stages
+
+
+def seed_uploads(db, uploads, users):
+    # `uploads` archivos repartidos entre `users` usuarios; el 80% con resumen
+    from users import User, UploadedFile, FileSummary
+
+    db.drop_all()
+    db.create_all()
+    admin = User(username='admin', role='admin')
+    admin.set_password('benchmark')
+    db.session.add(admin)
+    db.session.bulk_insert_mappings(User, [{'username': 'user{}'.format(i), 'password': '-', 'role': 'user'} for i in range(users)])
+    started = datetime(2021, 1, 1)
+    db.session.bulk_insert_mappings(UploadedFile, [{
+        'filename': 'history-{}.csv'.format(i),
+        'upload_date': started + pd.Timedelta(minutes=i),
+        'user_id': 2 + i % users,
+        'size': 1024,
+    } for i in range(uploads)])
+    db.session.bulk_insert_mappings(FileSummary, [{
+        'uploaded_file_id': i + 1,
+        'user_id': 2 + i % users,
+        'rows': 1000,
+        'computed_at': started,
+    } for i in range(uploads) if i % 5])
+    db.session.commit()
+
+
+def admin_stages(file_path, repeat=1, rows=1000):
+    # Páginas de administración con `rows` archivos subidos en la base de
+    # datos del benchmark (ver run_benchmark). El tiempo y el número de
+    # consultas por página no deben crecer con el número de archivos
+    from sqlalchemy import event
+    import app as webapp
+    from users import db
+
+    if 'DATABASE_URL' not in os.environ:
+        raise RuntimeError('The admin scenario only runs against the benchmark database')
+    flask_app = webapp.create_app({'SQLALCHEMY_DATABASE_URI': os.environ['DATABASE_URL']})
+    with flask_app.app_context():
+        seed_uploads(db, rows, max(rows // 20, 1))
+        engine = db.engine
+    client = flask_app.test_client()
+    client.post('/login', data={'username': 'admin', 'password': 'benchmark'})
+    last_page = max((rows + flask_app.config['ADMIN_PER_PAGE'] - 1) // flask_app.config['ADMIN_PER_PAGE'], 1)
+
+    queries = []
+
+    def count_query(*args):
+        queries.append(1)
+
+    stages = {}
+    event.listen(engine, 'before_cursor_execute', count_query)
+    try:
+        for stage, url in (('files_page', '/admin_files'), ('files_last_page', '/admin_files?page={}'.format(last_page)),
+                           ('users_page', '/admin')):
+            def get(url=url):
+                response = client.get(url)
+                if response.status_code != 200:
+                    raise RuntimeError('{} returned {}'.format(url, response.status_code))
+
+            stages[stage] = measure(get, repeat)
+            del queries[:]
+            get()
+            stages[stage]['queries'] = len(queries)
+    finally:
+        event.remove(engine, 'before_cursor_execute', count_query)
+    stages['_info'] = {'uploads': rows, 'queries': {stage: measures['queries'] for stage, measures in stages.items()}}
+    return stages
+
+
+# Arranque de un proceso de la aplicación: importación y create_app(), y
+# la primera petición. Se mide en un intérprete nuevo en cada ejecución,
+# dentro del directorio de trabajo del benchmark (carpetas y base de datos)
+STARTUP_SCRIPT = '''
+import json, sys, time
+started = time.perf_counter()
+import app
+flask_app = app.create_app()
+boot = time.perf_counter() - started
+started = time.perf_counter()
+flask_app.test_client().get('/login')
+login = time.perf_counter() - started
+# Pico de memoria residente del proceso (ru_maxrss incluye el del proceso
+# padre anterior al exec)
+with open('/proc/self/status') as f:
+    rss = next(int(line.split()[1]) for line in f if line.startswith('VmHWM')) / 1024
+json.dump({'boot': boot, 'login': login, 'rss_mb': rss, 'pandas': 'pandas' in sys.modules}, sys.stdout)
+'''
+
+
+def startup_stages(file_path, repeat=1, rows=None):
+    # Tiempo de arranque y memoria residente de un worker, con los módulos
+    # de análisis cargados al usarlos (boot) o por adelantado como en el
+    # maestro de gunicorn (boot_preload). peak_mb es el RSS del proceso
+    import subprocess
+
+    def run(preload):
+        env = dict(os.environ, PRELOAD_ANALYTICS='1' if preload else '0',
+                   PYTHONPATH=os.pathsep.join(filter(None, [os.path.dirname(os.path.abspath(__file__)), os.environ.get('PYTHONPATH')])))
+        output = subprocess.run([sys.executable, '-c', STARTUP_SCRIPT], cwd=os.path.dirname(file_path), env=env,
+                                check=True, stdout=subprocess.PIPE).stdout
+        return json.loads(output)
+
+    stages = {}
+    info = {}
+    for stage, preload in (('boot', False), ('boot_preload', True)):
+        runs = sorted((run(preload) for _ in range(max(repeat, 1))), key=lambda measures: measures['boot'])
+        middle = runs[len(runs) // 2]
+        stages[stage] = {'seconds': middle['boot'], 'min_seconds': runs[0]['boot'], 'peak_mb': middle['rss_mb']}
+        if not preload:
+            stages['login'] = {'seconds': middle['login'], 'min_seconds': min(r['login'] for r in runs), 'peak_mb': middle['rss_mb']}
+        info[stage + '_loads_pandas'] = middle['pandas']
+    stages['_info'] = info
+    return stages
+
+
+# Escenarios disponibles: nombre -> función(file_path, repeat, rows) que
+# devuelve un diccionario etapa -> medidas
+SCENARIOS = {
+    'analysis': analysis_stages,
+    'admin': admin_stages,
+    'startup': startup_stages,
+}
+
+
+def run_benchmark(sizes, scenarios=('analysis',), repeat=1, workdir=None, database_url=None, **options):
+    workdir = workdir or tempfile.mkdtemp(prefix='benchmark-')
+    # Base de datos propia: los escenarios no tocan la de la aplicación salvo
+    # que se pida otra con database_url
+    os.environ['DATABASE_URL'] = database_url or 'sqlite:///' + os.path.join(workdir, 'benchmark.db')
+    results = []
+    try:
+        for rows in sizes:
+            file_path = os.path.join(workdir, 'history-{}.csv'.format(rows))
+            started = time.perf_counter()
+            write_history(file_path, rows, **options)
+            generated = time.perf_counter() - started
+            for scenario in scenarios:
+                stages = SCENARIOS[scenario](file_path, repeat, rows)
+                info = stages.pop('_info', {})
+                for stage, measures in stages.items():
+                    entry = {'scenario': scenario, 'rows': rows, 'stage': stage}
+                    entry.update(measures)
+                    results.append(entry)
+                    print('{:>9} rows  {:<10} {:<10} {:8.3f}s  {:8.1f} MB'.format(
+                        rows, scenario, stage, measures['seconds'], measures['peak_mb']), file=sys.stderr)
+            print('{:>9} rows  file {:.1f} MB generated in {:.1f}s {}'.format(
+                rows, os.path.getsize(file_path) / 1024 / 1024, generated, info), file=sys.stderr)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return {
+        'meta': {
+            'created_at': datetime.utcnow().isoformat(),
+            'python': platform.python_version(),
+            'pandas': pd.__version__,
+            'platform': platform.platform(),
+            'repeat': repeat,
+            'options': {key: str(value) for key, value in options.items()},
+        },
+        'results': results,
+    }
+
+
+def compare(baseline, current, tolerance=0.25, min_seconds=0.05):
+    # Devuelve las etapas que tardan más de un `tolerance` por encima de la
+    # referencia; las etapas muy rápidas se ignoran porque el ruido domina
+    reference = {(r['scenario'], r['rows'], r['stage']): r for r in baseline['results']}
+    regressions = []
+    for result in current['results']:
+        old = reference.get((result['scenario'], result['rows'], result['stage']))
+        if old is None or max(old['seconds'], result['seconds']) < min_seconds:
+            continue
+        if result['seconds'] > old['seconds'] * (1 + tolerance):
+            regressions.append((result, old))
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark of the CSV analysis with synthetic tastytrade histories')
+    parser.add_argument('--rows', type=int, nargs='+', default=DEFAULT_SIZES, help='history sizes to benchmark')
+    parser.add_argument('--symbols', type=int, default=200, help='number of distinct symbols')
+    parser.add_argument('--option-ratio', type=float, default=0.7, help='fraction of trades that are options')
+    parser.add_argument('--dividend-density', type=float, default=0.02, help='fraction of rows that are dividends')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--scenario', nargs='+', default=['analysis'], choices=sorted(SCENARIOS))
+    parser.add_argument('--repeat', type=int, default=3, help='timed runs per stage (the median is reported)')
+    parser.add_argument('--output', help='write the results as JSON to this file')
+    parser.add_argument('--compare', help='baseline JSON file; exit with status 1 on regressions')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed slowdown against the baseline')
+    parser.add_argument('--generate', metavar='CSV', help='only write a synthetic history of --rows[0] rows')
+    parser.add_argument('--database-url', help='scratch database for the admin scenario (its tables are dropped)')
+    args = parser.parse_args()
+
+    options = dict(symbols=args.symbols, option_ratio=args.option_ratio, dividend_density=args.dividend_density, seed=args.seed)
+    if args.generate:
+        write_history(args.generate, args.rows[0], **options)
+        sys.exit(0)
+
+    report = run_benchmark(args.rows, scenarios=args.scenario, repeat=args.repeat, database_url=args.database_url, **options)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(baseline, report, args.tolerance)
+        for result, old in regressions:
+            print('REGRESSION {scenario} {rows} rows {stage}: {new:.3f}s (baseline {old:.3f}s)'.format(
+                new=result['seconds'], old=old['seconds'], **result), file=sys.stderr)
+        sys.exit(1 if regressions else 0)
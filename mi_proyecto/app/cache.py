@@ -0,0 +1,138 @@
+import hashlib
+import os
+import pickle
+import threading
+import zlib
+from collections import OrderedDict
+
+# Caché de resultados del análisis.
+# La clave es el hash SHA-256 del contenido del archivo más la versión del
+# análisis, así que un archivo modificado nunca devuelve resultados viejos.
+# Los resultados se guardan serializados y comprimidos, y se expulsan en
+# orden LRU cuando se supera el límite de tamaño o de entradas.
+# Opcionalmente se copian también a un directorio compartido, para que los
+# resultados calculados por un proceso estén disponibles en los demás.
+
+
+def file_digest(file_path, chunk_size=1024 * 1024):
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ResultCache:
+    def __init__(self, version, max_bytes=64 * 1024 * 1024, max_entries=256, directory=None, max_disk_bytes=512 * 1024 * 1024):
+        self.version = version
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.directory = directory
+        self.max_disk_bytes = max_disk_bytes
+        self._entries = OrderedDict()
+        self._digests = {}
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def key(self, digest, *extra):
+        return (digest, self.version) + extra
+
+    def key_for(self, file_path, *extra):
+        # Se evita volver a leer el archivo si no cambió su tamaño ni su mtime
+        try:
+            stat = os.stat(file_path)
+        except OSError:
+            return None
+        signature = (stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            cached = self._digests.get(file_path)
+        if cached is not None and cached[0] == signature:
+            digest = cached[1]
+        else:
+            digest = file_digest(file_path)
+            with self._lock:
+                self._digests[file_path] = (signature, digest)
+        return self.key(digest, *extra)
+
+    def remember(self, file_path, digest):
+        # Hash ya calculado al guardar el archivo: key_for no lo vuelve a leer
+        try:
+            stat = os.stat(file_path)
+        except OSError:
+            return
+        with self._lock:
+            self._digests[file_path] = ((stat.st_mtime_ns, stat.st_size), digest)
+
+    def _disk_path(self, key):
+        name = hashlib.sha1(repr(key).encode()).hexdigest()
+        return os.path.join(self.directory, '{}-{}.bin'.format(key[0], name))
+
+    def get(self, key):
+        if key is None:
+            return None
+        with self._lock:
+            blob = self._entries.get(key)
+            if blob is not None:
+                self._entries.move_to_end(key)
+        if blob is None:
+            blob = self._read_disk(key)
+            if blob is None:
+                return None
+            self._store(key, blob)
+        return pickle.loads(zlib.decompress(blob))
+
+    def set(self, key, value):
+        if key is None:
+            return
+        blob = zlib.compress(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL))
+        self._store(key, blob)
+        self._write_disk(key, blob)
+
+    def _store(self, key, blob):
+        if len(blob) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._size -= len(old)
+            self._entries[key] = blob
+            self._size += len(blob)
+            while self._size > self.max_bytes or len(self._entries) > self.max_entries:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= len(evicted)
+
+    def _read_disk(self, key):
+        if self.directory is None:
+            return None
+        try:
+            with open(self._disk_path(key), 'rb') as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def _write_disk(self, key, blob):
+        if self.directory is None or len(blob) > self.max_disk_bytes:
+            return
+        path = self._disk_path(key)
+        tmp_path = '{}.{}-{}.tmp'.format(path, os.getpid(), threading.get_ident())
+        with open(tmp_path, 'wb') as f:
+            f.write(blob)
+        os.replace(tmp_path, path)
+        self._trim_disk()
+
+    def _trim_disk(self):
+        # Se borran los archivos más antiguos hasta quedar bajo el límite
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith('.bin'):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_disk_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
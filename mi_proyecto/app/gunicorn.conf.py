@@ -0,0 +1,16 @@
+import os
+
+# Configuración de gunicorn: gunicorn -c gunicorn.conf.py wsgi:app
+# Con preload_app el proceso maestro importa la aplicación y, con
+# PRELOAD_ANALYTICS, también pandas, numpy y plotly (ver create_app) antes
+# de crear los workers. Tras el fork los workers comparten esas páginas de
+# memoria (copy-on-write) en lugar de cargar cada uno su copia, y ninguno
+# paga la importación en su primera petición.
+
+bind = os.environ.get('GUNICORN_BIND', '127.0.0.1:8000')
+workers = int(os.environ.get('GUNICORN_WORKERS', 2))
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 120))
+preload_app = True
+
+os.environ.setdefault('PRELOAD_ANALYTICS', '1')
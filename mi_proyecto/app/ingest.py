@@ -0,0 +1,101 @@
+import os
+import threading
+
+import pandas as pd
+
+# Ingesta de exportaciones de tastytrade.
+# El CSV se normaliza una sola vez al subirlo (números, fechas y categorías)
+# y se guarda en Parquet junto al archivo original; las vistas leen
+# directamente esa versión tipada. Los archivos que se leen son los objetos
+# de storage.py, con el hash del contenido como nombre, así que el Parquet
+# (objects/ab/<hash>.v3.parquet) también corresponde a un contenido fijo y
+# no hay que comprobar si es más antiguo que el CSV.
+
+FLOAT_COLUMNS = ['Value', 'Quantity', 'Average Price', 'Commissions', 'Fees', 'Multiplier', 'Strike Price']
+CATEGORY_COLUMNS = ['Type', 'Sub Type', 'Action', 'Symbol', 'Instrument Type', 'Root Symbol', 'Underlying Symbol', 'Call or Put']
+
+# Tipos de lectura explícitos: todo se lee como texto y se convierte en
+# normalize(), así cada trozo de un CSV leído por partes queda igual.
+# Order # se queda como texto: como número saldría float64 o int64 según
+# el archivo tenga filas sin orden o no
+CSV_DTYPES = {column: str for column in FLOAT_COLUMNS + CATEGORY_COLUMNS + ['Date', 'Description', 'Expiration Date', 'Order #']}
+
+# Columnas que el análisis no usa y no se leen en modo streaming
+STREAMING_SKIP_COLUMNS = {'Description'}
+
+# Formato explícito de cada columna de fecha conocida; sólo se usa la
+# detección automática (lenta) si el formato no coincide
+DATE_FORMATS = {
+    'Date': '%Y-%m-%dT%H:%M:%S%z',
+    'Expiration Date': '%m/%d/%y',
+}
+
+# Incrementar cuando cambie la normalización para regenerar los Parquet
+SCHEMA_VERSION = 3
+
+
+def columnar_path(file_path):
+    return '{}.v{}.parquet'.format(os.path.splitext(file_path)[0], SCHEMA_VERSION)
+
+
+def parse_amount(column):
+    # "-7,765.00" -> -7765.0; "--" y vacíos -> NaN
+    if column.dtype == 'object':
+        column = column.str.replace(',', '', regex=False)
+    return pd.to_numeric(column, errors='coerce').astype('float64')
+
+
+def parse_dates(column, date_format):
+    utc = '%z' in date_format
+    parsed = pd.to_datetime(column, format=date_format, errors='coerce', utc=utc)
+    if parsed.isna().sum() > column.isna().sum():
+        # Formato de otro broker: se deja que pandas lo detecte
+        parsed = pd.to_datetime(column, errors='coerce', utc=utc)
+    return parsed
+
+
+def normalize(data):
+    for column in FLOAT_COLUMNS:
+        if column in data.columns:
+            data[column] = parse_amount(data[column])
+    for column, date_format in DATE_FORMATS.items():
+        if column in data.columns:
+            data[column] = parse_dates(data[column], date_format)
+    for column in CATEGORY_COLUMNS:
+        if column in data.columns:
+            data[column] = data[column].astype('category')
+    return data
+
+
+def ingest_csv(file_path):
+    data = normalize(pd.read_csv(file_path, dtype=CSV_DTYPES))
+    # Se escribe en un temporal y se renombra (como en storage.py): otro
+    # trabajo que llame a load() nunca ve un Parquet a medio escribir
+    parquet_path = columnar_path(file_path)
+    tmp_path = '{}.{}-{}.tmp'.format(parquet_path, os.getpid(), threading.get_ident())
+    data.to_parquet(tmp_path, index=False)
+    os.replace(tmp_path, parquet_path)
+    return data
+
+
+def load(file_path):
+    # Usa la versión tipada si ya existe
+    parquet_path = columnar_path(file_path)
+    if os.path.exists(parquet_path):
+        return pd.read_parquet(parquet_path)
+    return ingest_csv(file_path)
+
+
+def iter_chunks(file_path, chunksize, skip_columns=STREAMING_SKIP_COLUMNS):
+    reader = pd.read_csv(file_path, dtype=CSV_DTYPES, chunksize=chunksize,
+                         usecols=lambda column: column not in skip_columns)
+    for chunk in reader:
+        yield normalize(chunk)
+
+
+def read_parts(file_path, streaming_threshold, chunksize, skip_columns=STREAMING_SKIP_COLUMNS):
+    # El archivo entero (versión tipada) o, si supera el umbral, trozos de
+    # chunksize filas para no cargarlo en memoria
+    if os.path.getsize(file_path) > streaming_threshold:
+        return iter_chunks(file_path, chunksize, skip_columns)
+    return iter([load(file_path)])
@@ -0,0 +1,192 @@
+import cProfile
+import io
+import os
+import pstats
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import g, has_request_context
+
+# Instrumentación de las etapas del análisis.
+# Cada etapa (lectura, agregación, gráficos, plantilla...) se mide con
+# metrics.stage(): tiempo, filas procesadas y variación de la memoria del
+# proceso. Los totales se exponen en formato Prometheus y, si la etapa se
+# ejecuta dentro de una petición, también en la cabecera Server-Timing.
+# Los contadores son de cada proceso; con varios workers cada uno publica
+# los suyos.
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+try:
+    PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+except (AttributeError, ValueError, OSError):
+    PAGE_SIZE = 4096
+
+
+def rss_bytes():
+    # Memoria residente actual; fuera de Linux, el pico del proceso
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        import resource
+    except ImportError:
+        return 0
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class StageTiming:
+    def __init__(self, name, rows=None):
+        self.name = name
+        self.rows = rows
+        self.seconds = 0.0
+        self.memory = 0
+
+
+def _new_stats(buckets):
+    return {'count': 0, 'seconds': 0.0, 'buckets': [0] * len(buckets), 'rows': 0, 'memory': 0}
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class Metrics:
+    def __init__(self, prefix='ionoswebb', buckets=BUCKETS):
+        self.prefix = prefix
+        self.buckets = buckets
+        self._stages = {}
+        self._requests = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name, rows=None):
+        # Las filas se pueden indicar al final: `with metrics.stage('parse') as timing: ...; timing.rows = n`
+        timing = StageTiming(name, rows)
+        memory = rss_bytes()
+        started = time.perf_counter()
+        try:
+            yield timing
+        finally:
+            timing.seconds = time.perf_counter() - started
+            timing.memory = rss_bytes() - memory
+            self.record(timing)
+            if has_request_context():
+                g.setdefault('stage_timings', []).append(timing)
+
+    def _observe(self, table, key, seconds):
+        stats = table.get(key)
+        if stats is None:
+            stats = table[key] = _new_stats(self.buckets)
+        stats['count'] += 1
+        stats['seconds'] += seconds
+        for i, bound in enumerate(self.buckets):
+            if seconds <= bound:
+                stats['buckets'][i] += 1
+        return stats
+
+    def record(self, timing):
+        with self._lock:
+            stats = self._observe(self._stages, timing.name, timing.seconds)
+            stats['rows'] += timing.rows or 0
+            stats['memory'] += timing.memory
+
+    def observe_request(self, endpoint, seconds):
+        with self._lock:
+            self._observe(self._requests, endpoint, seconds)
+
+    def snapshot(self):
+        with self._lock:
+            stages = {name: dict(stats, buckets=list(stats['buckets'])) for name, stats in self._stages.items()}
+            requests = {name: dict(stats, buckets=list(stats['buckets'])) for name, stats in self._requests.items()}
+        return stages, requests
+
+    def _histogram(self, lines, name, label, table):
+        for key, stats in sorted(table.items()):
+            labels = '{}="{}"'.format(label, _escape(key))
+            for bound, count in zip(self.buckets, stats['buckets']):
+                lines.append('{}_bucket{{{},le="{}"}} {}'.format(name, labels, bound, count))
+            lines.append('{}_bucket{{{},le="+Inf"}} {}'.format(name, labels, stats['count']))
+            lines.append('{}_sum{{{}}} {}'.format(name, labels, stats['seconds']))
+            lines.append('{}_count{{{}}} {}'.format(name, labels, stats['count']))
+
+    def render(self):
+        # Formato de texto de Prometheus (version 0.0.4)
+        stages, requests = self.snapshot()
+        prefix = self.prefix
+        lines = [
+            '# HELP {}_stage_seconds Wall time of each analysis stage.'.format(prefix),
+            '# TYPE {}_stage_seconds histogram'.format(prefix),
+        ]
+        self._histogram(lines, prefix + '_stage_seconds', 'stage', stages)
+        lines += [
+            '# HELP {}_stage_rows_total Rows processed by each analysis stage.'.format(prefix),
+            '# TYPE {}_stage_rows_total counter'.format(prefix),
+        ]
+        for name, stats in sorted(stages.items()):
+            lines.append('{}_stage_rows_total{{stage="{}"}} {}'.format(prefix, _escape(name), stats['rows']))
+        lines += [
+            '# HELP {}_stage_memory_delta_bytes Accumulated change of resident memory during each stage.'.format(prefix),
+            '# TYPE {}_stage_memory_delta_bytes counter'.format(prefix),
+        ]
+        for name, stats in sorted(stages.items()):
+            lines.append('{}_stage_memory_delta_bytes{{stage="{}"}} {}'.format(prefix, _escape(name), stats['memory']))
+        lines += [
+            '# HELP {}_request_seconds Wall time of each request by endpoint.'.format(prefix),
+            '# TYPE {}_request_seconds histogram'.format(prefix),
+        ]
+        self._histogram(lines, prefix + '_request_seconds', 'endpoint', requests)
+        lines += [
+            '# HELP {}_resident_memory_bytes Resident memory of this process.'.format(prefix),
+            '# TYPE {}_resident_memory_bytes gauge'.format(prefix),
+            '{}_resident_memory_bytes {}'.format(prefix, rss_bytes()),
+        ]
+        return '\n'.join(lines) + '\n'
+
+
+def server_timing(timings, total=None):
+    # Las etapas repetidas (por ejemplo, cada trozo de un CSV grande) se suman
+    merged = {}
+    for timing in timings:
+        seconds, rows = merged.get(timing.name, (0.0, 0))
+        merged[timing.name] = (seconds + timing.seconds, rows + (timing.rows or 0))
+    entries = []
+    for name, (seconds, rows) in merged.items():
+        if rows:
+            entries.append('{};desc="{} rows";dur={:.1f}'.format(name, rows, seconds * 1000))
+        else:
+            entries.append('{};dur={:.1f}'.format(name, seconds * 1000))
+    if total is not None:
+        entries.append('total;dur={:.1f}'.format(total * 1000))
+    return ', '.join(entries)
+
+
+# Perfiles de cProfile bajo demanda.
+# Sólo perfilan el hilo de la petición: el análisis en segundo plano se
+# mide con las etapas de arriba o con benchmark.py.
+
+def start_profile():
+    profile = cProfile.Profile()
+    try:
+        profile.enable()
+    except ValueError:
+        # Ya hay otro perfilador activo en el proceso
+        return None
+    return profile
+
+
+def dump_profile(profile, folder, name):
+    profile.disable()
+    os.makedirs(folder, exist_ok=True)
+    path = os.path.join(folder, '{}-{}.prof'.format(name, time.time_ns()))
+    profile.dump_stats(path)
+    return path
+
+
+def profile_report(path, limit=40):
+    output = io.StringIO()
+    pstats.Stats(path, stream=output).sort_stats('cumulative').print_stats(limit)
+    return output.getvalue()
@@ -0,0 +1,57 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from users import db, AnalysisJob
+
+# Cola de trabajos de análisis en segundo plano.
+# Los trabajos se ejecutan en un pool de hilos local y su estado se guarda
+# en la tabla AnalysisJob, así que cualquier proceso puede consultarlo.
+
+
+class JobQueue:
+    def __init__(self, max_workers=2):
+        self.max_workers = max_workers
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        # El pool se crea en cada proceso: los hilos no sobreviven a un fork
+        with self._lock:
+            if self._executor is None or self._pid != os.getpid():
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='analysis')
+                self._pid = os.getpid()
+            return self._executor
+
+    def submit(self, app, job_id, func, *args):
+        return self._get_executor().submit(self._run, app, job_id, func, args)
+
+    def _run(self, app, job_id, func, args):
+        with app.app_context():
+            try:
+                update_job(job_id, status='running', stage='starting')
+                error = func(*args, progress=lambda percent, stage: update_job(job_id, progress=percent, stage=stage))
+            except Exception as e:
+                error = str(e)
+            try:
+                if error:
+                    update_job(job_id, status='error', error=error, finished_at=datetime.utcnow())
+                else:
+                    update_job(job_id, status='done', progress=100, stage='done', finished_at=datetime.utcnow())
+            finally:
+                db.session.remove()
+
+
+def update_job(job_id, **fields):
+    AnalysisJob.query.filter_by(id=job_id).update(fields)
+    db.session.commit()
+
+
+def is_stale(job, timeout):
+    # Un trabajo sin terminar más antiguo que el límite se da por perdido
+    # (por ejemplo, si el proceso que lo ejecutaba se reinició)
+    if job.status not in ('pending', 'running'):
+        return False
+    return (datetime.utcnow() - job.created_at).total_seconds() > timeout
@@ -0,0 +1,163 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+
+import analysis
+import ingest
+
+try:
+    import fcntl
+except ImportError:
+    # Windows: sólo se protegen los hilos del mismo proceso
+    fcntl = None
+
+# Historial persistente de transacciones por usuario.
+# Cada importación incremental añade sólo las filas que no estaban ya en el
+# historial (misma Date, Order #, Symbol y Value) como un nuevo archivo
+# Parquet, y actualiza los totales acumulados sumando los de esas filas,
+# sin volver a recorrer el historial completo. Las importaciones de un
+# mismo usuario se hacen de una en una (ver locked()): leer las claves,
+# escribir la parte y actualizar summary.json es una sola operación.
+
+KEY_COLUMNS = ['Date', 'Order #', 'Symbol', 'Value']
+SUMMARY_FILE = 'summary.json'
+LOCK_FILE = '.lock'
+
+_locks = {}
+_locks_lock = threading.Lock()
+
+
+def ledger_folder(base_folder, user_id):
+    return os.path.join(base_folder, str(user_id))
+
+
+@contextmanager
+def locked(folder):
+    # Bloqueo del historial entre hilos y, con fcntl, entre procesos (workers)
+    with _locks_lock:
+        lock = _locks.setdefault(os.path.abspath(folder), threading.Lock())
+    with lock:
+        os.makedirs(folder, exist_ok=True)
+        if fcntl is None:
+            yield
+            return
+        with open(os.path.join(folder, LOCK_FILE), 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _order_number(value):
+    if pd.isna(value):
+        return ''
+    if isinstance(value, (int, float, np.number)) and float(value).is_integer():
+        return '{:.0f}'.format(value)
+    return str(value).strip()
+
+
+def order_numbers(column):
+    # Order # como texto; las partes guardadas antes lo tienen como número
+    # (123.0 si el archivo tenía filas sin orden)
+    return column.astype(object).map(_order_number)
+
+
+def row_keys(data):
+    keys = pd.DataFrame({
+        'Date': data['Date'].values.astype('datetime64[ns]').view('int64'),
+        'Order #': order_numbers(data['Order #']).values,
+        'Symbol': data['Symbol'].astype(object).fillna('').values,
+        'Value': data['Value'].fillna(0.0).values,
+    })
+    return pd.Series(pd.util.hash_pandas_object(keys, index=False).values, index=data.index)
+
+
+def _parts(folder):
+    if not os.path.isdir(folder):
+        return []
+    return sorted(os.path.join(folder, name) for name in os.listdir(folder) if name.endswith('.parquet'))
+
+
+def existing_keys(folder):
+    keys = [row_keys(pd.read_parquet(part, columns=KEY_COLUMNS)) for part in _parts(folder)]
+    if not keys:
+        return pd.Series([], dtype='uint64')
+    return pd.concat(keys, ignore_index=True)
+
+
+def summarize(data):
+    equity = data[data['Instrument Type'] == 'Equity']
+    return {
+        'rows': int(len(data)),
+        'deposits': float(analysis.total_deposits(data)),
+        'dividends': analysis.dividends_by_symbol(data),
+        'stock': analysis.stock_balance(equity).to_dict(),
+        'option_pl': analysis.option_pl(data).to_dict(),
+    }
+
+
+def merge_summaries(old, new):
+    merged = {
+        'rows': old.get('rows', 0) + new['rows'],
+        'deposits': old.get('deposits', 0.0) + new['deposits'],
+    }
+    for section in ('dividends', 'stock', 'option_pl'):
+        totals = dict(old.get(section, {}))
+        for symbol, value in new[section].items():
+            totals[symbol] = totals.get(symbol, 0.0) + float(value)
+        merged[section] = totals
+    return merged
+
+
+def load_summary(folder):
+    path = os.path.join(folder, SUMMARY_FILE)
+    if not os.path.exists(path):
+        return {'rows': 0, 'deposits': 0.0, 'dividends': {}, 'stock': {}, 'option_pl': {}}
+    with open(path) as f:
+        return json.load(f)
+
+
+def _write_summary(folder, summary):
+    path = os.path.join(folder, SUMMARY_FILE)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(summary, f)
+    os.replace(tmp_path, path)
+
+
+def append_chunks(folder, chunks):
+    # Importa un archivo leído por partes (ver ingest.read_parts). Las filas
+    # se comparan con el historial anterior a la importación, igual que si
+    # el archivo se importara entero; cada trozo con filas nuevas es una parte
+    with locked(folder):
+        existing = existing_keys(folder)
+        summary = load_summary(folder)
+        added = 0
+        for data in chunks:
+            missing = [column for column in KEY_COLUMNS if column not in data.columns]
+            if missing:
+                raise ValueError('Missing columns for incremental import: {}'.format(', '.join(missing)))
+            new_rows = data[~row_keys(data).isin(existing)]
+            if new_rows.empty:
+                continue
+
+            # Las categorías se guardan como texto para que todas las partes
+            # tengan el mismo esquema
+            part = new_rows.copy()
+            for column in ingest.CATEGORY_COLUMNS:
+                if column in part.columns:
+                    part[column] = part[column].astype(object)
+            part['Order #'] = order_numbers(part['Order #'])
+            part.to_parquet(os.path.join(folder, 'part-{}.parquet'.format(time.time_ns())), index=False)
+
+            # El resumen se escribe con cada parte para que siempre coincida
+            summary = merge_summaries(summary, summarize(new_rows))
+            _write_summary(folder, summary)
+            added += len(new_rows)
+        return added
@@ -0,0 +1,190 @@
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+# Emparejamiento de lotes FIFO.
+# Las operaciones que abren o cierran posiciones se recorren una sola vez en
+# orden cronológico. Cada símbolo (acción o contrato de opción) tiene una
+# cola de lotes abiertos; una operación en sentido contrario cierra primero
+# los lotes más antiguos, también parcialmente, y el resto abre un lote
+# nuevo. Los vencimientos y asignaciones (filas Receive Deliver) cierran la
+# posición sin flujo de caja. Value ya incluye el multiplicador del
+# contrato, así que el P/L realizado es directamente la suma de los flujos
+# de apertura y cierre de las cantidades emparejadas.
+
+# Sub Types que retiran una posición sin precio de cierre
+REMOVAL_SUB_TYPES = {'Expiration', 'Assignment', 'Exercise', 'Cash Settled Assignment', 'Cash Settled Exercise'}
+
+FILL_COLUMNS = ['date', 'seq', 'symbol', 'underlying', 'instrument', 'direction', 'quantity', 'value', 'fees', 'multiplier', 'removal']
+# Columnas de texto de las operaciones, guardadas como categorías: en un
+# archivo leído por partes se acumulan las de todos los bloques
+TEXT_COLUMNS = ['symbol', 'underlying', 'instrument']
+POSITION_COLUMNS = ['underlying', 'instrument', 'open_quantity', 'open_cost', 'realized_pl', 'fees', 'multiplier', 'date']
+
+# Cantidades menores se consideran cero (las reinversiones de dividendos
+# tienen fracciones de acción)
+EPSILON = 1e-9
+
+
+def empty_fills():
+    return pd.DataFrame({column: pd.Series(dtype=object) for column in FILL_COLUMNS})
+
+
+def empty_realized():
+    frame = pd.DataFrame({'symbol': pd.Series(dtype=object), 'underlying': pd.Series(dtype=object),
+                          'instrument': pd.Series(dtype=object), 'quantity': pd.Series(dtype='float64'),
+                          'pl': pd.Series(dtype='float64')})
+    frame.index = pd.DatetimeIndex([], name='date')
+    return frame
+
+
+def _text(data, column):
+    if column not in data.columns:
+        return pd.Series('', index=data.index, dtype=object)
+    return data[column].astype(object).fillna('')
+
+
+def _number(data, column):
+    if column not in data.columns:
+        return pd.Series(0.0, index=data.index)
+    return pd.to_numeric(data[column], errors='coerce').fillna(0.0)
+
+
+def fills(data, dates):
+    # Filas que abren o cierran posiciones, con sólo las columnas necesarias.
+    # dates: la columna Date ya convertida (ver analysis.date_column)
+    if dates is None or 'Symbol' not in data.columns:
+        return empty_fills()
+    action = _text(data, 'Action')
+    sub_type = _text(data, 'Sub Type')
+    removal = sub_type.isin(REMOVAL_SUB_TYPES)
+    mask = dates.notna() & data['Symbol'].notna() & (action.str.contains('_TO_', regex=False) | removal)
+    rows = data[mask]
+    action, removal = action[mask], removal[mask]
+
+    dates = dates[mask]
+    if dates.dt.tz is not None:
+        dates = dates.dt.tz_convert('UTC').dt.tz_localize(None)
+    underlying = _text(rows, 'Underlying Symbol')
+    symbol = _text(rows, 'Symbol')
+    multiplier = _number(rows, 'Multiplier')
+    frame = pd.DataFrame({
+        'date': dates.values,
+        'seq': rows.index.values,
+        'symbol': symbol.values,
+        'underlying': underlying.where(underlying != '', symbol).values,
+        'instrument': _text(rows, 'Instrument Type').values,
+        'direction': np.where(action.str.startswith('BUY'), 1, -1).astype('int8'),
+        'quantity': _number(rows, 'Quantity').abs().values,
+        'value': _number(rows, 'Value').values,
+        'fees': (_number(rows, 'Commissions') + _number(rows, 'Fees')).values,
+        'multiplier': multiplier.where(multiplier != 0, 1.0).values,
+        'removal': removal.values,
+    })
+    for column in TEXT_COLUMNS:
+        frame[column] = frame[column].astype('category')
+    return frame
+
+
+def merge(parts):
+    # Une las operaciones de los bloques de un archivo una sola vez, antes
+    # de emparejarlas; las categorías de cada bloque se unen sin pasar a texto
+    parts = [part for part in parts if not part.empty]
+    if not parts:
+        return empty_fills()
+    if len(parts) == 1:
+        return parts[0]
+    merged = pd.concat([part.drop(columns=TEXT_COLUMNS) for part in parts], ignore_index=True)
+    for column in TEXT_COLUMNS:
+        merged[column] = union_categoricals([part[column] for part in parts])
+    return merged[FILL_COLUMNS]
+
+
+def match(fills):
+    # Devuelve (posiciones por símbolo, P/L realizado por operación de cierre)
+    if fills.empty:
+        return pd.DataFrame(columns=POSITION_COLUMNS), empty_realized()
+
+    # Orden cronológico; a igual fecha, el orden inverso del archivo (las
+    # exportaciones van de la más reciente a la más antigua)
+    order = np.lexsort((-fills['seq'].to_numpy(dtype='int64'), fills['date'].to_numpy()))
+    fills = fills.iloc[order].reset_index(drop=True)
+    codes, symbols = pd.factorize(fills['symbol'])
+
+    # Una cola de lotes (cantidad con signo, flujo por unidad) por símbolo;
+    # el bucle sólo usa tipos de Python y las tablas se montan después con
+    # operaciones vectoriales. Los lotes son tuplas para que el recolector
+    # de basura no tenga que recorrer cientos de miles de listas, y las
+    # colas son listas y no deque: casi todos los contratos de opción tienen
+    # uno o dos lotes y una deque vacía ocupa diez veces más que una lista
+    books = [[] for _ in range(len(symbols))]
+    closing_rows, closing_quantities, closing_pls = [], [], []
+    columns = zip(codes.tolist(), fills['direction'].tolist(), fills['quantity'].tolist(),
+                  fills['value'].tolist(), fills['removal'].tolist())
+    for row, (code, direction, quantity, value, removal) in enumerate(columns):
+        book = books[code]
+        if removal:
+            # Vencimiento/asignación: se cierra la posición que haya, a cero
+            if not book:
+                continue
+            direction = -1 if book[0][0] > 0 else 1
+            unit = 0.0
+        else:
+            unit = value / quantity if quantity else 0.0
+
+        remaining = quantity
+        pl = 0.0
+        closed = 0.0
+        while remaining > EPSILON and book and (book[0][0] > 0) != (direction > 0):
+            lot_quantity, lot_unit = book[0]
+            size = min(remaining, abs(lot_quantity))
+            pl += size * (lot_unit + unit)
+            closed += size
+            remaining -= size
+            lot_quantity += size if lot_quantity < 0 else -size
+            if abs(lot_quantity) <= EPSILON:
+                del book[0]
+            else:
+                book[0] = (lot_quantity, lot_unit)
+        if closed:
+            closing_rows.append(row)
+            closing_quantities.append(closed)
+            closing_pls.append(pl)
+        if remaining > EPSILON and not removal:
+            book.append((direction * remaining, unit))
+
+    count = len(symbols)
+    first = fills.groupby(codes, sort=True).head(1)
+    table = pd.DataFrame({
+        'underlying': first['underlying'].to_numpy(),
+        'instrument': first['instrument'].to_numpy(),
+        'open_quantity': [sum(lot[0] for lot in book) if book else 0.0 for book in books],
+        'open_cost': [sum(abs(lot[0]) * lot[1] for lot in book) if book else 0.0 for book in books],
+        'realized_pl': np.bincount(codes[closing_rows], weights=closing_pls, minlength=count),
+        'fees': np.bincount(codes, weights=fills['fees'].to_numpy(dtype='float64'), minlength=count),
+        'multiplier': first['multiplier'].to_numpy(),
+        'date': fills['date'].groupby(codes).max().to_numpy(),
+    }, index=pd.Index(symbols, dtype=object))
+
+    closing = fills.iloc[closing_rows]
+    realized = pd.DataFrame({
+        'symbol': closing['symbol'].to_numpy(),
+        'underlying': closing['underlying'].to_numpy(),
+        'instrument': closing['instrument'].to_numpy(),
+        'quantity': np.asarray(closing_quantities, dtype='float64'),
+        'pl': np.asarray(closing_pls, dtype='float64'),
+    }, index=pd.DatetimeIndex(closing['date'], name='date'))
+    return table, realized
+
+
+def summary(positions, realized):
+    equity = realized['instrument'] == 'Equity'
+    open_positions = positions[positions['open_quantity'].abs() > EPSILON]
+    open_equity = open_positions['instrument'] == 'Equity'
+    return {
+        'realized_equity': float(realized.loc[equity, 'pl'].sum()),
+        'realized_options': float(realized.loc[~equity, 'pl'].sum()),
+        'open_positions': int(len(open_positions)),
+        'open_equity_cost': float(open_positions.loc[open_equity, 'open_cost'].sum()),
+        'open_option_cost': float(open_positions.loc[~open_equity, 'open_cost'].sum()),
+    }
@@ -0,0 +1,46 @@
+"""initial tables
+
+Revision ID: 5b0e1c9a7d34
+Revises: 
+Create Date: 2026-10-18 09:10:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5b0e1c9a7d34'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Tablas originales de la aplicación. Las bases de datos creadas antes
+    # con db.create_all() (como site.db) ya las tienen y no tienen versión:
+    # en ese caso no se crean de nuevo
+    tables = sa.inspect(op.get_bind()).get_table_names()
+    if 'user' not in tables:
+        op.create_table('user',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('username', sa.String(length=150), nullable=False),
+        sa.Column('password', sa.String(length=150), nullable=False),
+        sa.Column('role', sa.String(length=50), nullable=False),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('username')
+        )
+    if 'uploaded_file' not in tables:
+        op.create_table('uploaded_file',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('filename', sa.String(length=255), nullable=False),
+        sa.Column('upload_date', sa.DateTime(), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+        sa.PrimaryKeyConstraint('id')
+        )
+
+
+def downgrade():
+    op.drop_table('uploaded_file')
+    op.drop_table('user')
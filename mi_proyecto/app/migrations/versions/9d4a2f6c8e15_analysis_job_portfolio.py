@@ -0,0 +1,26 @@
+"""analysis job portfolio
+
+Revision ID: 9d4a2f6c8e15
+Revises: f2d84c6e1b57
+Create Date: 2026-10-18 16:40:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9d4a2f6c8e15'
+down_revision = 'f2d84c6e1b57'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('analysis_job', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('portfolio', sa.Boolean(), server_default=sa.false(), nullable=False))
+
+
+def downgrade():
+    with op.batch_alter_table('analysis_job', schema=None) as batch_op:
+        batch_op.drop_column('portfolio')
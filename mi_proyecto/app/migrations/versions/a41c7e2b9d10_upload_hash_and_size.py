@@ -0,0 +1,30 @@
+"""upload hash and size
+
+Revision ID: a41c7e2b9d10
+Revises: 5b0e1c9a7d34
+Create Date: 2026-10-18 09:20:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a41c7e2b9d10'
+down_revision = '5b0e1c9a7d34'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('uploaded_file', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('sha256', sa.String(length=64), nullable=True))
+        batch_op.add_column(sa.Column('size', sa.BigInteger(), nullable=True))
+        batch_op.create_index(batch_op.f('ix_uploaded_file_sha256'), ['sha256'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('uploaded_file', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_uploaded_file_sha256'))
+        batch_op.drop_column('size')
+        batch_op.drop_column('sha256')
@@ -0,0 +1,27 @@
+"""uploaded file indexes
+
+Revision ID: c58e0f3a6b21
+Revises: a41c7e2b9d10
+Create Date: 2026-10-18 09:45:00.000000
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'c58e0f3a6b21'
+down_revision = 'a41c7e2b9d10'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('uploaded_file', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_uploaded_file_upload_date'), ['upload_date'], unique=False)
+        batch_op.create_index(batch_op.f('ix_uploaded_file_user_id'), ['user_id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('uploaded_file', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_uploaded_file_user_id'))
+        batch_op.drop_index(batch_op.f('ix_uploaded_file_upload_date'))
@@ -0,0 +1,45 @@
+"""analysis job
+
+Revision ID: e7b3f19a0c42
+Revises: c58e0f3a6b21
+Create Date: 2026-10-18 11:10:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e7b3f19a0c42'
+down_revision = 'c58e0f3a6b21'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('analysis_job',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('filename', sa.String(length=255), nullable=False),
+    sa.Column('status', sa.String(length=20), nullable=False),
+    sa.Column('progress', sa.Integer(), nullable=False),
+    sa.Column('stage', sa.String(length=50), nullable=True),
+    sa.Column('error', sa.Text(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.Column('finished_at', sa.DateTime(), nullable=True),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('uploaded_file_id', sa.Integer(), nullable=True),
+    sa.Column('incremental', sa.Boolean(), nullable=False),
+    sa.Column('ledger_rows', sa.Integer(), nullable=True),
+    sa.ForeignKeyConstraint(['uploaded_file_id'], ['uploaded_file.id'], ),
+    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('analysis_job', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_analysis_job_filename'), ['filename'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('analysis_job', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_analysis_job_filename'))
+
+    op.drop_table('analysis_job')
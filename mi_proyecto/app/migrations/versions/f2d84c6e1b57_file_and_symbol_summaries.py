@@ -0,0 +1,75 @@
+"""file and symbol summaries
+
+Revision ID: f2d84c6e1b57
+Revises: e7b3f19a0c42
+Create Date: 2026-10-18 11:25:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f2d84c6e1b57'
+down_revision = 'e7b3f19a0c42'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('file_summary',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('uploaded_file_id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('rows', sa.Integer(), nullable=False),
+    sa.Column('first_date', sa.DateTime(), nullable=True),
+    sa.Column('last_date', sa.DateTime(), nullable=True),
+    sa.Column('num_equity_actions', sa.Integer(), nullable=False),
+    sa.Column('num_equity_options', sa.Integer(), nullable=False),
+    sa.Column('deposits', sa.Float(), nullable=False),
+    sa.Column('acciones_en_proceso', sa.Float(), nullable=False),
+    sa.Column('total_dividends', sa.Float(), nullable=False),
+    sa.Column('pl_acciones', sa.Float(), nullable=False),
+    sa.Column('total_opciones_en_proceso', sa.Float(), nullable=False),
+    sa.Column('total_pl_opciones', sa.Float(), nullable=False),
+    sa.Column('efectivo', sa.Float(), nullable=False),
+    sa.Column('computed_at', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['uploaded_file_id'], ['uploaded_file.id'], ),
+    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('uploaded_file_id')
+    )
+    with op.batch_alter_table('file_summary', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_file_summary_user_id'), ['user_id'], unique=False)
+
+    op.create_table('symbol_summary',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('uploaded_file_id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('symbol', sa.String(length=64), nullable=False),
+    sa.Column('equity_count', sa.Integer(), nullable=False),
+    sa.Column('stock', sa.Float(), nullable=False),
+    sa.Column('income', sa.Float(), nullable=False),
+    sa.Column('dividends', sa.Float(), nullable=False),
+    sa.Column('option_count', sa.Integer(), nullable=False),
+    sa.Column('option_pl', sa.Float(), nullable=False),
+    sa.Column('option_dollar', sa.Float(), nullable=False),
+    sa.ForeignKeyConstraint(['uploaded_file_id'], ['uploaded_file.id'], ),
+    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('symbol_summary', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_symbol_summary_uploaded_file_id'), ['uploaded_file_id'], unique=False)
+        batch_op.create_index('ix_symbol_summary_user_symbol', ['user_id', 'symbol'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('symbol_summary', schema=None) as batch_op:
+        batch_op.drop_index('ix_symbol_summary_user_symbol')
+        batch_op.drop_index(batch_op.f('ix_symbol_summary_uploaded_file_id'))
+
+    op.drop_table('symbol_summary')
+    with op.batch_alter_table('file_summary', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_file_summary_user_id'))
+
+    op.drop_table('file_summary')
@@ -0,0 +1,97 @@
+import argparse
+import json
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+import analysis
+import ingest
+
+# Análisis consolidado de varias cuentas/archivos.
+# Cada archivo se agrega en un proceso distinto del pool y después se
+# suman las tablas por símbolo para obtener un único informe. Los archivos
+# que superan el umbral se leen por partes, como en la vista de un archivo.
+# El informe no incluye lotes FIFO ni resúmenes por fecha, así que no se
+# calculan.
+# En la aplicación el análisis se ejecuta en un hilo de la cola de trabajos;
+# los procesos del pool no se crean con fork (que copiaría un proceso con
+# varios hilos y sus bloqueos) sino desde un servidor forkserver o, donde no
+# existe, con spawn.
+
+EQUITY_COLUMNS = ['count', 'stock', 'income']
+UNDERLYING_COLUMNS = ['count', 'value', 'quantity', 'dollar', 'pl']
+
+# Valores por defecto de STREAMING_THRESHOLD_BYTES y STREAMING_CHUNK_ROWS
+STREAMING_THRESHOLD_BYTES = 50 * 1024 * 1024
+CHUNK_ROWS = 25000
+
+
+def mp_context():
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+
+
+def file_aggregates(file_path, streaming_threshold=STREAMING_THRESHOLD_BYTES, chunk_rows=CHUNK_ROWS):
+    # Se ejecuta en un proceso del pool: sólo devuelve las tablas por
+    # símbolo, sin resumen diario ni operaciones (ver analysis.aggregate)
+    aggregates = None
+    for data in ingest.read_parts(file_path, streaming_threshold, chunk_rows):
+        aggregates = analysis.combine(aggregates, analysis.aggregate(data, detail=False))
+    if aggregates is None:
+        raise ValueError('Empty file: {}'.format(os.path.basename(file_path)))
+    return os.path.basename(file_path), aggregates
+
+
+def merge(parts):
+    aggregates = None
+    for _, part in parts:
+        aggregates = analysis.combine(aggregates, part)
+    results = analysis.finish(aggregates)
+    if not results['dates']:
+        raise ValueError('No dates found in the selected files')
+    return {
+        'files': [{'file': name, 'rows': part['rows']} for name, part in parts],
+        'dates': results['dates'],
+        'equity': results['equity'][EQUITY_COLUMNS],
+        'underlying': results['underlying'][UNDERLYING_COLUMNS],
+        'dividends': results['dividends'],
+        'deposits': results['deposits'],
+        'totals': results['summary'],
+    }
+
+
+def analyze(file_paths, max_workers=None, streaming_threshold=STREAMING_THRESHOLD_BYTES, chunk_rows=CHUNK_ROWS, names=None):
+    # names: nombres que se muestran en el informe, si no son los de las rutas
+    if not file_paths:
+        raise ValueError('No files to analyze')
+    read = partial(file_aggregates, streaming_threshold=streaming_threshold, chunk_rows=chunk_rows)
+    if len(file_paths) == 1:
+        parts = [read(file_paths[0])]
+    else:
+        workers = min(len(file_paths), max_workers or os.cpu_count() or 1)
+        with ProcessPoolExecutor(max_workers=workers, mp_context=mp_context()) as executor:
+            parts = list(executor.map(read, file_paths))
+    if names is not None:
+        parts = [(name, part) for name, (_, part) in zip(names, parts)]
+    return merge(parts)
+
+
+def to_json(report):
+    return json.dumps({
+        'files': report['files'],
+        'dates': [report['dates'][0].isoformat(), report['dates'][1].isoformat(), report['dates'][2]],
+        'equity': report['equity'].to_dict(orient='index'),
+        'underlying': report['underlying'].to_dict(orient='index'),
+        'dividends': report['dividends'],
+        'deposits': report['deposits'],
+        'totals': report['totals'],
+    }, indent=2, default=float)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Consolidated analysis of several tastytrade exports')
+    parser.add_argument('files', nargs='+', help='CSV files to analyze')
+    parser.add_argument('--workers', type=int, default=None, help='number of worker processes (default: CPU count)')
+    args = parser.parse_args()
+    print(to_json(analyze(args.files, max_workers=args.workers)))
@@ -0,0 +1,119 @@
+import pandas as pd
+
+import analysis
+import lots
+import rollups
+
+# Resultados del análisis de un archivo.
+# Sustituye a la tupla de 32 elementos que devolvía process_csv: los datos
+# por símbolo se guardan en dos DataFrames (acciones y subyacentes) y una
+# Series de dividendos, y los totales y el Resumen Financiero se calculan
+# sólo cuando una vista los pide. El objeto se guarda tal cual en la caché
+# de resultados; los valores calculados bajo demanda no se serializan.
+# El resumen diario (ver rollups.py) permite obtener los resultados de un
+# rango de fechas y las series temporales sin volver a leer el archivo.
+# Las posiciones y el P/L realizado por lotes FIFO vienen de lots.py.
+# Los archivos que superan el umbral de streaming se resumen sin resumen
+# diario ni lotes (detail=False), para que la memoria no crezca con el
+# tamaño del archivo: no tienen rangos de fechas, series ni posiciones.
+
+
+class AnalysisResults:
+    __slots__ = ('rows', 'first_date', 'last_date', 'num_equity_actions', 'num_equity_options',
+                 'equity', 'underlying', 'dividends', 'deposits', 'daily', 'positions', 'realized', 'detail', '_summary', '_rollups')
+
+    def __init__(self, rows, first_date, last_date, num_equity_actions, num_equity_options, equity, underlying, dividends, deposits, daily=None,
+                 positions=None, realized=None, detail=True):
+        self.rows = rows
+        self.first_date = first_date
+        self.last_date = last_date
+        self.num_equity_actions = num_equity_actions
+        self.num_equity_options = num_equity_options
+        self.equity = equity
+        self.underlying = underlying
+        self.dividends = dividends
+        self.deposits = deposits
+        self.daily = rollups.empty() if daily is None else daily
+        self.positions = pd.DataFrame(columns=lots.POSITION_COLUMNS) if positions is None else positions
+        self.realized = lots.empty_realized() if realized is None else realized
+        self.detail = detail
+        self._summary = None
+        self._rollups = None
+
+    @classmethod
+    def from_aggregates(cls, aggregates):
+        results = analysis.finish(aggregates)
+        if not results['dates']:
+            raise ValueError("No dates found in file")
+        first_date, last_date, _ = results['dates']
+        dividends = pd.Series(results['dividends'], dtype='float64')
+        return cls(results['rows'], first_date, last_date, results['num_equity_actions'], results['num_equity_options'],
+                   results['equity'], results['underlying'], dividends, float(results['deposits']), results['daily'],
+                   results['positions'], results['realized'], results['detail'])
+
+    # Serialización: sólo los datos, nunca los valores calculados
+    def __getstate__(self):
+        return {name: getattr(self, name) for name in self.__slots__ if not name.startswith('_')}
+
+    def __setstate__(self, state):
+        for name, value in state.items():
+            setattr(self, name, value)
+        self._summary = None
+        self._rollups = None
+
+    @property
+    def dates(self):
+        # [primera fecha, última fecha, días] como los muestra la página
+        return [self.first_date.strftime('%Y-%m-%d'), self.last_date.strftime('%Y-%m-%d'), (self.last_date - self.first_date).days]
+
+    @property
+    def summary(self):
+        if self._summary is None:
+            self._summary = analysis.financial_summary(self.equity, self.underlying, self.dividends.to_dict(), self.deposits)
+        return self._summary
+
+    @property
+    def lot_summary(self):
+        # P/L realizado FIFO, comisiones y coste de las posiciones abiertas
+        return lots.summary(self.positions, self.realized)
+
+    @property
+    def total_income_sum(self):
+        return self.equity['income'].sum()
+
+    @property
+    def total_dividends_sum(self):
+        return self.dividends.sum()
+
+    @property
+    def total_pl_2_sum(self):
+        return self.underlying['pl'].sum()
+
+    def rollup(self, freq):
+        # Resumen diario, mensual o anual; los dos últimos se calculan una vez
+        if self._rollups is None:
+            self._rollups = {}
+        if freq not in self._rollups:
+            self._rollups[freq] = rollups.rollup(self.daily, freq)
+        return self._rollups[freq]
+
+    def between(self, start=None, end=None):
+        # Resultados de las transacciones entre dos fechas (AAAA-MM-DD, inclusivas)
+        if not self.detail:
+            raise ValueError('Date ranges are not available for files read in parts')
+        rows = rollups.slice_range(self.daily, start, end)
+        if rows.empty:
+            raise ValueError('No transactions between {} and {}'.format(start or 'the first date', end or 'the last date'))
+        aggregates = rollups.aggregates(rows)
+        aggregates['daily'] = [rows]
+        results = AnalysisResults.from_aggregates(aggregates)
+        # Los lotes dependen de todo lo anterior: las posiciones abiertas son
+        # las del final del archivo y el P/L realizado, el de los cierres del rango
+        realized = rollups.slice_range(self.realized, start, end)
+        results.realized = realized
+        results.positions = self.positions.assign(
+            realized_pl=realized.groupby('symbol')['pl'].sum().reindex(self.positions.index, fill_value=0.0))
+        return results
+
+    def time_series(self, metric, freq='M', start=None, end=None):
+        return rollups.time_series(rollups.slice_range(self.rollup(freq), start, end), metric)
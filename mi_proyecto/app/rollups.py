@@ -0,0 +1,152 @@
+import pandas as pd
+
+# Agregados por fecha.
+# Cada transacción se acumula en un resumen diario por símbolo, tipo de
+# instrumento y Sub Type, con el índice de fechas ordenado; los resúmenes
+# mensuales y anuales se obtienen del diario, y cualquier rango de fechas
+# se corta con búsqueda binaria sobre el índice en lugar de recorrer el CSV.
+# Las opciones se agrupan por su subyacente.
+
+KEY_COLUMNS = ['symbol', 'instrument', 'sub_type']
+VALUE_COLUMNS = ['count', 'value', 'quantity', 'income', 'value_quantity']
+
+# Frecuencias de los resúmenes: D (diario), M (mensual), Y (anual)
+FREQUENCIES = ('D', 'M', 'Y')
+
+# Series temporales disponibles: nombre -> (título, filtro de filas, columna)
+METRICS = {
+    'dividends': ("Dividends", lambda rows: rows['sub_type'] == 'Dividend', 'value'),
+    'deposits': ("Deposits", lambda rows: rows['sub_type'] == 'Deposit', 'value'),
+    'equity_pl': ("P/L Acciones", lambda rows: rows['instrument'] == 'Equity', 'income'),
+    'option_pl': ("P/L Opciones", lambda rows: ~rows['instrument'].isin(['Equity', '']), 'value_quantity'),
+}
+
+
+def empty():
+    frame = pd.DataFrame({column: pd.Series(dtype=object) for column in KEY_COLUMNS})
+    for column in VALUE_COLUMNS:
+        frame[column] = pd.Series(dtype='int64' if column == 'count' else 'float64')
+    frame.index = pd.DatetimeIndex([], name='day')
+    return frame
+
+
+def _text(data, column):
+    if column not in data.columns:
+        return pd.Series('', index=data.index, dtype=object)
+    return data[column].astype(object).fillna('')
+
+
+def _number(data, column):
+    if column not in data.columns:
+        return pd.Series(0.0, index=data.index)
+    return pd.to_numeric(data[column], errors='coerce').fillna(0.0)
+
+
+def _regroup(frame):
+    grouped = frame.groupby(['day'] + KEY_COLUMNS, sort=True)[VALUE_COLUMNS].sum()
+    return grouped.reset_index().set_index('day')
+
+
+def daily(data, dates):
+    # dates: la columna Date ya convertida (ver analysis.date_column)
+    if dates is None or not dates.notna().any():
+        return empty()
+    valid = dates.notna()
+    rows = data[valid]
+    day = dates[valid]
+    if day.dt.tz is not None:
+        day = day.dt.tz_convert('UTC').dt.tz_localize(None)
+
+    underlying = _text(rows, 'Underlying Symbol')
+    # Igual que analysis.option_pl, que agrupa por Root Symbol y sólo cuenta
+    # las raíces que coinciden con un subyacente (SPXW, VIXW... quedan fuera)
+    same_root = (underlying != '') & (_text(rows, 'Root Symbol') == underlying)
+    quantity = _number(rows, 'Quantity')
+    value = _number(rows, 'Value')
+    frame = pd.DataFrame({
+        'day': day.dt.normalize().values,
+        'symbol': underlying.where(underlying != '', _text(rows, 'Symbol')).values,
+        'instrument': _text(rows, 'Instrument Type').values,
+        'sub_type': _text(rows, 'Sub Type').values,
+        'count': 1,
+        'value': value.values,
+        'quantity': quantity.values,
+        'income': (quantity * _number(rows, 'Average Price')).values,
+        'value_quantity': (value * quantity).where(same_root, 0.0).values,
+    })
+    return _regroup(frame)
+
+
+def merge(parts):
+    # Une los resúmenes diarios de los bloques de un archivo; se reagrupa una
+    # sola vez al final en lugar de en cada bloque
+    parts = [part for part in parts if not part.empty]
+    if not parts:
+        return empty()
+    if len(parts) == 1:
+        return parts[0]
+    return _regroup(pd.concat([part.reset_index() for part in parts], ignore_index=True))
+
+
+def rollup(frame, freq):
+    if freq not in FREQUENCIES:
+        raise ValueError(f'Unknown frequency: {freq}')
+    if freq == 'D' or frame.empty:
+        return frame
+    periods = frame.index.to_period(freq).to_timestamp()
+    return _regroup(frame.reset_index().assign(day=periods))
+
+
+def slice_range(frame, start=None, end=None):
+    # El índice está ordenado: el rango se busca en O(log n); end es inclusivo
+    index = frame.index
+    first = 0 if start is None else index.searchsorted(pd.Timestamp(start), side='left')
+    last = len(index) if end is None else index.searchsorted(pd.Timestamp(end) + pd.Timedelta(days=1), side='left')
+    return frame.iloc[first:last]
+
+
+def time_series(frame, metric):
+    _, select, column = METRICS[metric]
+    rows = frame[select(frame)]
+    return rows[column].groupby(level=0).sum()
+
+
+def aggregates(rows):
+    # Agregados parciales con la forma de analysis.aggregate() a partir de un
+    # trozo del resumen diario, para calcular los resultados de un rango
+    rows = rows.reset_index()
+    equity_rows = rows[rows['instrument'] == 'Equity']
+    by_symbol = equity_rows.groupby('symbol', sort=False)
+    equity = pd.DataFrame({
+        'date': by_symbol['day'].max(),
+        'count': by_symbol['count'].sum(),
+        'income': by_symbol['income'].sum(),
+        'total_sum': by_symbol['quantity'].sum() + by_symbol['income'].sum(),
+    })
+    trades = equity_rows[equity_rows['sub_type'].isin(['Buy to Open', 'Sell to Close'])]
+    signed = trades['quantity'].where(trades['sub_type'] == 'Buy to Open', -trades['quantity'])
+
+    option_rows = rows[~rows['instrument'].isin(['Equity', ''])]
+    by_underlying = option_rows.groupby('symbol', sort=False)
+    underlying = pd.DataFrame({
+        'date': by_underlying['day'].max(),
+        'count': by_underlying['count'].sum(),
+        'value': by_underlying['value'].sum(),
+        'quantity': by_underlying['quantity'].sum(),
+        'dollar': by_underlying['value'].sum(),
+    })
+
+    dividend_rows = rows[rows['sub_type'] == 'Dividend']
+    return {
+        'rows': int(rows['count'].sum()),
+        'first_date': rows['day'].min() if not rows.empty else pd.NaT,
+        'last_date': rows['day'].max() if not rows.empty else pd.NaT,
+        'num_equity_actions': int(equity_rows['count'].sum()),
+        'num_equity_options': int(rows.loc[rows['instrument'] == 'Equity Option', 'count'].sum()),
+        'equity': equity,
+        'stock': signed.groupby(trades['symbol']).sum(),
+        'dividends': dividend_rows['value'].groupby(dividend_rows['symbol']).sum().to_dict(),
+        'underlying': underlying,
+        'option_pl': option_rows['value_quantity'].groupby(option_rows['symbol']).sum(),
+        'deposits': rows.loc[rows['sub_type'] == 'Deposit', 'value'].sum(),
+    }
@@ -0,0 +1,84 @@
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+
+# Almacenamiento de los archivos subidos.
+# El contenido se guarda una sola vez, con su hash SHA-256 como nombre
+# (objects/ab/abcd....csv), y cada usuario ve sus archivos en
+# users/<id>/<nombre>, un enlace duro al objeto. El hash se calcula mientras
+# el archivo se escribe por partes en un temporal; el objeto y el enlace del
+# usuario se crean con os.replace, así que nadie lee un archivo a medio
+# escribir y dos usuarios que suben el mismo nombre de archivo no se pisan.
+
+CHUNK_SIZE = 1024 * 1024
+
+
+def object_path(folder, digest):
+    return os.path.join(folder, 'objects', digest[:2], digest + '.csv')
+
+
+def user_path(folder, user_id, filename):
+    return os.path.join(folder, 'users', str(user_id), filename)
+
+
+def _tmp_path(path):
+    return '{}.{}-{}.tmp'.format(path, os.getpid(), threading.get_ident())
+
+
+def _write_temp(stream, directory, chunk_size):
+    # Copia el stream a un temporal y devuelve (ruta, hash, tamaño)
+    os.makedirs(directory, exist_ok=True)
+    digest = hashlib.sha256()
+    size = 0
+    f = tempfile.NamedTemporaryFile(dir=directory, suffix='.tmp', delete=False)
+    try:
+        with f:
+            for chunk in iter(lambda: stream.read(chunk_size), b''):
+                digest.update(chunk)
+                f.write(chunk)
+                size += len(chunk)
+    except BaseException:
+        os.remove(f.name)
+        raise
+    return f.name, digest.hexdigest(), size
+
+
+def _link(source, path):
+    # Sustituye path por un enlace a source de forma atómica
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = _tmp_path(path)
+    try:
+        os.link(source, tmp_path)
+    except OSError:
+        # Sistemas de archivos sin enlaces duros: se copia el contenido
+        shutil.copyfile(source, tmp_path)
+    os.replace(tmp_path, path)
+
+
+def save(stream, folder, user_id, filename, chunk_size=CHUNK_SIZE):
+    # Guarda un archivo subido; devuelve (ruta del usuario, hash, tamaño)
+    tmp_path, digest, size = _write_temp(stream, os.path.join(folder, 'tmp'), chunk_size)
+    target = object_path(folder, digest)
+    if os.path.exists(target):
+        # El mismo contenido ya está guardado
+        os.remove(tmp_path)
+    else:
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        os.replace(tmp_path, target)
+    path = user_path(folder, user_id, filename)
+    _link(target, path)
+    return path, digest, size
+
+
+def find(folder, user_id, filename):
+    # Ruta del archivo de un usuario; los subidos antes de este formato
+    # siguen en la raíz de la carpeta
+    path = user_path(folder, user_id, filename)
+    if os.path.exists(path):
+        return path
+    legacy_path = os.path.join(folder, filename)
+    if os.path.exists(legacy_path):
+        return legacy_path
+    return None
@@ -0,0 +1,122 @@
+from datetime import datetime
+
+from sqlalchemy import func
+from sqlalchemy.orm import joinedload
+
+from users import db, UploadedFile, FileSummary, SymbolSummary
+
+# Resúmenes persistentes del análisis.
+# Al terminar el análisis de un archivo se guardan el Resumen Financiero y
+# los totales por símbolo en FileSummary / SymbolSummary; las páginas que
+# muestran totales de varios archivos los leen con una sola consulta SQL
+# en lugar de volver a analizar los CSV. pandas sólo se importa al guardar
+# un resumen, para que las páginas que leen no lo carguen.
+
+SUMMARY_FIELDS = ['acciones_en_proceso', 'total_dividends', 'pl_acciones', 'total_opciones_en_proceso', 'total_pl_opciones', 'efectivo']
+
+
+def _naive_utc(timestamp):
+    import pandas as pd
+    if timestamp is None or pd.isna(timestamp):
+        return None
+    timestamp = pd.Timestamp(timestamp)
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.tz_convert('UTC').tz_localize(None)
+    return timestamp.to_pydatetime()
+
+
+def symbol_rows(results):
+    # Una fila por símbolo con las columnas de acciones y de opciones
+    import pandas as pd
+    equity, underlying, dividends = results.equity, results.underlying, results.dividends
+    symbols = equity.index.append(underlying.index).append(dividends.index).drop_duplicates()
+    frame = pd.DataFrame({
+        'equity_count': equity['count'].reindex(symbols, fill_value=0),
+        'stock': equity['stock'].reindex(symbols, fill_value=0.0),
+        'income': equity['income'].reindex(symbols, fill_value=0.0),
+        'dividends': dividends.reindex(symbols, fill_value=0.0),
+        'option_count': underlying['count'].reindex(symbols, fill_value=0),
+        'option_pl': underlying['pl'].reindex(symbols, fill_value=0.0),
+        'option_dollar': underlying['dollar'].reindex(symbols, fill_value=0.0),
+    }, index=symbols).fillna(0)
+    return [{
+        'symbol': str(symbol),
+        'equity_count': int(row.equity_count),
+        'stock': float(row.stock),
+        'income': float(row.income),
+        'dividends': float(row.dividends),
+        'option_count': int(row.option_count),
+        'option_pl': float(row.option_pl),
+        'option_dollar': float(row.option_dollar),
+    } for symbol, row in zip(symbols, frame.itertuples(index=False))]
+
+
+def store(uploaded_file, results):
+    # Sustituye el resumen anterior del archivo, si lo había
+    SymbolSummary.query.filter_by(uploaded_file_id=uploaded_file.id).delete()
+    summary = FileSummary.query.filter_by(uploaded_file_id=uploaded_file.id).first()
+    if summary is None:
+        summary = FileSummary(uploaded_file_id=uploaded_file.id, user_id=uploaded_file.user_id)
+        db.session.add(summary)
+    summary.rows = int(results.rows)
+    summary.first_date = _naive_utc(results.first_date)
+    summary.last_date = _naive_utc(results.last_date)
+    summary.num_equity_actions = int(results.num_equity_actions)
+    summary.num_equity_options = int(results.num_equity_options)
+    summary.deposits = float(results.deposits)
+    for field in SUMMARY_FIELDS:
+        setattr(summary, field, float(results.summary[field]))
+    summary.computed_at = datetime.utcnow()
+
+    rows = symbol_rows(results)
+    for row in rows:
+        row['uploaded_file_id'] = uploaded_file.id
+        row['user_id'] = uploaded_file.user_id
+    db.session.bulk_insert_mappings(SymbolSummary, rows)
+    db.session.commit()
+    return summary
+
+
+def current_uploads():
+    # Ids de los archivos que cuentan en los totales. Volver a subir un
+    # archivo crea otro UploadedFile con su propio resumen: de cada nombre
+    # (por usuario) sólo cuenta la última subida analizada, y de las que
+    # tienen el mismo contenido (sha256) con nombres distintos, sólo una
+    latest = db.session.query(func.max(UploadedFile.id).label('id')).join(
+        FileSummary, FileSummary.uploaded_file_id == UploadedFile.id
+    ).group_by(UploadedFile.user_id, UploadedFile.filename).subquery()
+    return db.session.query(func.max(UploadedFile.id)).filter(
+        UploadedFile.id.in_(db.session.query(latest.c.id))
+    ).group_by(UploadedFile.user_id, func.coalesce(UploadedFile.sha256, UploadedFile.filename))
+
+
+def totals(user_id=None):
+    # Suma de los resúmenes de todos los archivos (de un usuario o de todos)
+    columns = [func.coalesce(func.sum(getattr(FileSummary, field)), 0.0).label(field) for field in ['deposits'] + SUMMARY_FIELDS]
+    query = db.session.query(func.count(FileSummary.id).label('files'), func.coalesce(func.sum(FileSummary.rows), 0).label('rows'), *columns)
+    query = query.filter(FileSummary.uploaded_file_id.in_(current_uploads()))
+    if user_id is not None:
+        query = query.filter(FileSummary.user_id == user_id)
+    return query.one()._asdict()
+
+
+def top_symbols(user_id, limit=10):
+    total = func.sum(SymbolSummary.income + SymbolSummary.dividends + SymbolSummary.option_pl)
+    return db.session.query(
+        SymbolSummary.symbol,
+        func.sum(SymbolSummary.income).label('income'),
+        func.sum(SymbolSummary.dividends).label('dividends'),
+        func.sum(SymbolSummary.option_pl).label('option_pl'),
+        total.label('total'),
+    ).filter(SymbolSummary.user_id == user_id, SymbolSummary.uploaded_file_id.in_(current_uploads())).group_by(SymbolSummary.symbol).order_by(total.desc()).limit(limit).all()
+
+
+def files_page(page=1, per_page=50):
+    # Una página de archivos subidos, los más recientes primero, con su
+    # usuario; los resúmenes de esa página (None si todavía no se analizaron)
+    # se leen con una sola consulta más. Devuelve (paginación, [(archivo, resumen)])
+    query = UploadedFile.query.options(joinedload(UploadedFile.user)).order_by(UploadedFile.upload_date.desc(), UploadedFile.id.desc())
+    pagination = query.paginate(page=page, per_page=per_page, error_out=False)
+    ids = [uploaded_file.id for uploaded_file in pagination.items]
+    found = {summary.uploaded_file_id: summary for summary in FileSummary.query.filter(FileSummary.uploaded_file_id.in_(ids))} if ids else {}
+    return pagination, [(uploaded_file, found.get(uploaded_file.id)) for uploaded_file in pagination.items]
@@ -0,0 +1,141 @@
+import math
+from datetime import datetime
+
+import pandas as pd
+
+# Tablas por símbolo de la página de resultados.
+# En lugar de pintar todas las filas en la plantilla, la página pide a la
+# API páginas ya filtradas y ordenadas en el servidor. Las filas se
+# construyen una vez a partir de los resultados del análisis (o de los de
+# un rango de fechas) y se guardan en la caché; cada petición sólo filtra,
+# ordena y corta.
+
+TABLES = {
+    'equity': ['date', 'symbol', 'count', 'stock', 'income', 'total_sum', 'dividends'],
+    'underlying': ['date', 'symbol', 'count', 'value', 'quantity', 'pl', 'dollar'],
+    'positions': ['date', 'symbol', 'underlying', 'instrument', 'open_quantity', 'open_cost', 'realized_pl', 'fees'],
+}
+
+# Columnas numéricas que se suman en los totales de la selección
+TOTAL_COLUMNS = {
+    'equity': ['count', 'income', 'dividends'],
+    'underlying': ['count', 'value', 'pl', 'dollar'],
+    'positions': ['open_cost', 'realized_pl', 'fees'],
+}
+
+DEFAULT_PER_PAGE = 50
+MAX_PER_PAGE = 500
+
+
+def _dates(column):
+    dates = pd.to_datetime(column, utc=True).dt.strftime('%Y-%m-%d')
+    return [None if pd.isna(value) else value for value in dates]
+
+
+def _numbers(column):
+    return [None if pd.isna(value) else float(value) for value in column]
+
+
+def build_rows(results, table):
+    # Filas de la tabla a partir de los DataFrames de AnalysisResults
+    if table == 'equity':
+        frame = results.equity
+        columns = {
+            'date': _dates(frame['date']),
+            'symbol': frame.index.tolist(),
+            'count': frame['count'].astype(int).tolist(),
+            'stock': _numbers(frame['stock']),
+            'income': _numbers(frame['income']),
+            'total_sum': _numbers(frame['total_sum']),
+            'dividends': _numbers(results.dividends.reindex(frame.index)),
+        }
+    elif table == 'positions':
+        frame = results.positions
+        columns = {
+            'date': _dates(frame['date']),
+            'symbol': frame.index.tolist(),
+            'underlying': frame['underlying'].tolist(),
+            'instrument': frame['instrument'].tolist(),
+            'open_quantity': _numbers(frame['open_quantity']),
+            'open_cost': _numbers(frame['open_cost']),
+            'realized_pl': _numbers(frame['realized_pl']),
+            'fees': _numbers(frame['fees']),
+        }
+    else:
+        frame = results.underlying
+        columns = {
+            'date': _dates(frame['date']),
+            'symbol': frame.index.tolist(),
+            'count': frame['count'].astype(int).tolist(),
+            'value': _numbers(frame['value']),
+            'quantity': _numbers(frame['quantity']),
+            'pl': _numbers(frame['pl']),
+            'dollar': _numbers(frame['dollar']),
+        }
+    return [dict(zip(columns, values)) for values in zip(*columns.values())]
+
+
+def parse_query(table, args):
+    # Parámetros de la petición: start, end, q, sort, order, page, per_page, series.
+    # start y end se aplican al construir las filas, no en query()
+    columns = TABLES[table]
+    for value in (args.get('start'), args.get('end')):
+        if value:
+            try:
+                datetime.strptime(value, '%Y-%m-%d')
+            except ValueError:
+                raise ValueError('Dates must use the YYYY-MM-DD format')
+    sort = args.get('sort') or None
+    if sort is not None and sort not in columns:
+        raise ValueError(f'Unknown sort column: {sort}')
+    series = args.get('series') or None
+    if series is not None and series not in columns:
+        raise ValueError(f'Unknown series column: {series}')
+    try:
+        page = max(int(args.get('page', 1)), 1)
+        per_page = min(max(int(args.get('per_page', DEFAULT_PER_PAGE)), 1), MAX_PER_PAGE)
+    except ValueError:
+        raise ValueError('page and per_page must be integers')
+    return {
+        'start': args.get('start') or None,
+        'end': args.get('end') or None,
+        'q': (args.get('q') or '').strip().upper() or None,
+        'sort': sort,
+        'descending': args.get('order') == 'desc',
+        'page': page,
+        'per_page': per_page,
+        'series': series,
+    }
+
+
+def query(rows, table, q=None, sort=None, descending=False, page=1, per_page=DEFAULT_PER_PAGE, series=None):
+    selected = rows
+    if q is not None:
+        selected = [row for row in selected if q in str(row['symbol']).upper()]
+
+    if sort is not None:
+        # Los valores vacíos van siempre al final
+        present = [row for row in selected if row[sort] is not None]
+        missing = [row for row in selected if row[sort] is None]
+        selected = sorted(present, key=lambda row: row[sort], reverse=descending) + missing
+
+    totals = {column: sum(row[column] or 0 for row in selected) for column in TOTAL_COLUMNS[table]}
+    pages = max(math.ceil(len(selected) / per_page), 1)
+    first = (page - 1) * per_page
+    response = {
+        'table': table,
+        'columns': TABLES[table],
+        'page': page,
+        'per_page': per_page,
+        'pages': pages,
+        'total': len(selected),
+        'totals': totals,
+        'rows': selected[first:first + per_page],
+    }
+    if series is not None:
+        # Valores de una columna para todas las filas seleccionadas (gráficos)
+        series_values = {}
+        for row in selected:
+            series_values[row['symbol']] = series_values.get(row['symbol'], 0.0) + (row[series] or 0)
+        response['series'] = series_values
+    return response
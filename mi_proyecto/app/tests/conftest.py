@@ -0,0 +1,6 @@
+import os
+import sys
+
+# Los módulos de la aplicación se importan como en app.py (import analysis...)
+APP_FOLDER = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, APP_FOLDER)
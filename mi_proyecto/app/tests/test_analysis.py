@@ -0,0 +1,85 @@
+import json
+import os
+
+import pandas as pd
+import pytest
+
+import analysis
+import ingest
+from results import AnalysisResults
+
+# Equivalencia del motor de agregación con el process_csv original.
+# fixtures/tastytrade_baseline.json son las salidas del bucle por símbolo
+# anterior para el CSV de tastytrade incluido en uploads/. El process_csv
+# original leía el CSV sin normalizar (los importes con separador de miles
+# no se convertían), así que el motor se compara con esa misma lectura.
+
+FOLDER = os.path.dirname(os.path.abspath(__file__))
+CSV_PATH = os.path.join(os.path.dirname(FOLDER), 'uploads', 'tastytrade_transactions_history_x5WX19307_210601_to_240511.csv')
+BASELINE_PATH = os.path.join(FOLDER, 'fixtures', 'tastytrade_baseline.json')
+
+
+@pytest.fixture(scope='module')
+def baseline():
+    with open(BASELINE_PATH) as f:
+        return json.load(f)
+
+
+@pytest.fixture(scope='module')
+def results():
+    return AnalysisResults.from_aggregates(analysis.aggregate(pd.read_csv(CSV_PATH)))
+
+
+def _day(value):
+    return None if pd.isna(value) else pd.Timestamp(value).strftime('%Y-%m-%d')
+
+
+def test_dates_and_counts(results, baseline):
+    assert results.dates == baseline['dates']
+    assert results.num_equity_actions == baseline['num_equity_actions']
+    assert results.num_equity_options == baseline['num_equity_options']
+
+
+def test_equity_table(results, baseline):
+    assert sorted(results.equity.index) == sorted(baseline['equity'])
+    for symbol, expected in baseline['equity'].items():
+        row = results.equity.loc[symbol]
+        assert _day(row['date']) == expected['date'], symbol
+        for column in ('count', 'stock', 'income', 'total_sum'):
+            assert row[column] == pytest.approx(expected[column], abs=1e-6), (symbol, column)
+
+
+def test_underlying_table(results, baseline):
+    assert sorted(results.underlying.index) == sorted(baseline['underlying'])
+    for symbol, expected in baseline['underlying'].items():
+        row = results.underlying.loc[symbol]
+        assert _day(row['date']) == expected['date'], symbol
+        for column in ('count', 'value', 'quantity', 'global_value', 'dollar', 'pl'):
+            assert row[column] == pytest.approx(expected[column], abs=1e-6), (symbol, column)
+
+
+def test_dividends(results, baseline):
+    assert results.dividends.to_dict() == pytest.approx(baseline['dividends'], abs=1e-6)
+
+
+def test_totals_and_summary(results, baseline):
+    assert results.deposits == pytest.approx(baseline['deposits'], abs=1e-6)
+    assert results.total_income_sum == pytest.approx(baseline['totals']['total_income_sum'], abs=1e-6)
+    assert results.total_dividends_sum == pytest.approx(baseline['totals']['total_dividends_sum'], abs=1e-6)
+    assert results.total_pl_2_sum == pytest.approx(baseline['totals']['total_pl_2_sum'], abs=1e-6)
+    for field, expected in baseline['summary'].items():
+        assert results.summary[field] == pytest.approx(expected, abs=1e-6), field
+
+
+def test_chunked_matches_whole():
+    # Un archivo leído por partes (ver ingest.iter_chunks) da los mismos
+    # resultados que leído entero, también el resumen diario y los lotes
+    whole = AnalysisResults.from_aggregates(analysis.aggregate(ingest.normalize(pd.read_csv(CSV_PATH, dtype=ingest.CSV_DTYPES))))
+    aggregates = None
+    for chunk in ingest.iter_chunks(CSV_PATH, 300):
+        aggregates = analysis.combine(aggregates, analysis.aggregate(chunk))
+    chunked = AnalysisResults.from_aggregates(aggregates)
+    assert chunked.summary == pytest.approx(whole.summary, abs=1e-6)
+    pd.testing.assert_frame_equal(chunked.daily, whole.daily)
+    pd.testing.assert_frame_equal(chunked.positions.sort_index(), whole.positions.sort_index())
+    pd.testing.assert_frame_equal(chunked.realized, whole.realized, check_categorical=False)
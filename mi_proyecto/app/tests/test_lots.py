@@ -0,0 +1,95 @@
+import pandas as pd
+import pytest
+
+import lots
+
+# Casos pequeños de emparejamiento FIFO. Las filas se escriben como en las
+# exportaciones de tastytrade: de la más reciente a la más antigua, con
+# Value ya multiplicado (negativo al comprar, positivo al vender).
+
+COLUMNS = ['Date', 'Sub Type', 'Action', 'Symbol', 'Instrument Type', 'Underlying Symbol', 'Value', 'Quantity',
+           'Commissions', 'Fees', 'Multiplier']
+
+
+def _match(rows):
+    data = pd.DataFrame(rows, columns=COLUMNS)
+    dates = pd.to_datetime(data['Date'], utc=True)
+    return lots.match(lots.fills(data, dates))
+
+
+def _stock(date, action, quantity, value, fees=0.0):
+    sub_type = 'Buy to Open' if action.startswith('BUY') else 'Sell to Close'
+    return [date, sub_type, action, 'XYZ', 'Equity', 'XYZ', value, quantity, fees, 0.0, 1.0]
+
+
+def _option(date, sub_type, action, quantity, value, symbol='XYZ   240119P00050000'):
+    return [date, sub_type, action, symbol, 'Equity Option', 'XYZ', value, quantity, 0.0, 0.0, 100.0]
+
+
+def test_partial_close():
+    positions, realized = _match([
+        _stock('2024-01-05T10:00:00-0500', 'SELL_TO_CLOSE', 4, 480.0, fees=1.0),
+        _stock('2024-01-02T10:00:00-0500', 'BUY_TO_OPEN', 10, -1000.0, fees=1.0),
+    ])
+    position = positions.loc['XYZ']
+    assert realized['pl'].tolist() == pytest.approx([4 * (120 - 100)])
+    assert realized['quantity'].tolist() == pytest.approx([4])
+    assert position['open_quantity'] == pytest.approx(6)
+    assert position['open_cost'] == pytest.approx(-600)
+    assert position['fees'] == pytest.approx(2)
+
+
+def test_position_flip():
+    # La venta cierra los 5 comprados y abre un corto con los 3 restantes
+    positions, realized = _match([
+        _stock('2024-01-05T10:00:00-0500', 'SELL_TO_CLOSE', 8, 880.0),
+        _stock('2024-01-02T10:00:00-0500', 'BUY_TO_OPEN', 5, -500.0),
+    ])
+    position = positions.loc['XYZ']
+    assert realized['pl'].tolist() == pytest.approx([5 * (110 - 100)])
+    assert realized['quantity'].tolist() == pytest.approx([5])
+    assert position['open_quantity'] == pytest.approx(-3)
+    assert position['open_cost'] == pytest.approx(3 * 110)
+
+
+def test_expiration_removes_position():
+    # La opción vendida vence sin valor: toda la prima es P/L realizado
+    positions, realized = _match([
+        _option('2024-01-19T16:00:00-0500', 'Expiration', None, 1, 0.0),
+        _option('2024-01-02T10:00:00-0500', 'Sell to Open', 'SELL_TO_OPEN', 1, 250.0),
+    ])
+    position = positions.loc['XYZ   240119P00050000']
+    assert realized['pl'].tolist() == pytest.approx([250])
+    assert position['open_quantity'] == pytest.approx(0)
+    assert position['open_cost'] == pytest.approx(0)
+    assert position['multiplier'] == 100
+
+
+def test_assignment_leaves_stock():
+    # Put vendida y asignada: la opción se cierra a cero y queda la acción
+    # comprada al strike
+    positions, realized = _match([
+        _stock('2024-01-19T16:00:00-0500', 'BUY_TO_OPEN', 100, -5000.0),
+        _option('2024-01-19T16:00:00-0500', 'Assignment', None, 1, 0.0),
+        _option('2024-01-02T10:00:00-0500', 'Sell to Open', 'SELL_TO_OPEN', 1, 200.0),
+    ])
+    option = positions.loc['XYZ   240119P00050000']
+    stock = positions.loc['XYZ']
+    assert realized['symbol'].tolist() == ['XYZ   240119P00050000']
+    assert realized['pl'].tolist() == pytest.approx([200])
+    assert option['open_quantity'] == pytest.approx(0)
+    assert stock['open_quantity'] == pytest.approx(100)
+    assert stock['open_cost'] == pytest.approx(-5000)
+    assert stock['realized_pl'] == pytest.approx(0)
+
+
+def test_equal_timestamps_follow_file_order():
+    # Con la misma hora, la fila de más abajo en el archivo es la anterior:
+    # primero se abre y después vence. En el orden contrario el vencimiento
+    # no encontraría posición y la opción quedaría abierta
+    positions, realized = _match([
+        _option('2024-01-19T16:00:00-0500', 'Expiration', None, 1, 0.0),
+        _option('2024-01-19T16:00:00-0500', 'Sell to Open', 'SELL_TO_OPEN', 1, 30.0),
+    ])
+    assert realized['pl'].tolist() == pytest.approx([30])
+    assert positions.loc['XYZ   240119P00050000', 'open_quantity'] == pytest.approx(0)
@@ -19,6 +19,64 @@ class User(UserMixin, db.Model):
 class UploadedFile(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     filename = db.Column(db.String(255), nullable=False)
-    upload_date = db.Column(db.DateTime, nullable=False)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    upload_date = db.Column(db.DateTime, nullable=False, index=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+    # Hash SHA-256 y tamaño del contenido (ver storage.py); vacíos en los
+    # archivos subidos antes de guardarlos por contenido
+    sha256 = db.Column(db.String(64), index=True)
+    size = db.Column(db.BigInteger)
     user = db.relationship('User', backref=db.backref('uploaded_files', lazy=True))
+
+class AnalysisJob(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    filename = db.Column(db.String(255), nullable=False, index=True)
+    status = db.Column(db.String(20), nullable=False, default='pending')
+    progress = db.Column(db.Integer, nullable=False, default=0)
+    stage = db.Column(db.String(50))
+    error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, nullable=False)
+    finished_at = db.Column(db.DateTime)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    uploaded_file_id = db.Column(db.Integer, db.ForeignKey('uploaded_file.id'))
+    # Importación incremental al historial (ver ledger.py) y filas añadidas
+    incremental = db.Column(db.Boolean, nullable=False, default=False)
+    ledger_rows = db.Column(db.Integer)
+    # Análisis consolidado de varios archivos (ver portfolio.py)
+    portfolio = db.Column(db.Boolean, nullable=False, default=False, server_default=db.false())
+    uploaded_file = db.relationship('UploadedFile', backref=db.backref('analysis_jobs', lazy=True))
+
+# Resumen de cada archivo analizado: se escribe al terminar el análisis para
+# que las páginas de inicio y de administración no tengan que releer los CSV
+class FileSummary(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    uploaded_file_id = db.Column(db.Integer, db.ForeignKey('uploaded_file.id'), nullable=False, unique=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+    rows = db.Column(db.Integer, nullable=False, default=0)
+    first_date = db.Column(db.DateTime)
+    last_date = db.Column(db.DateTime)
+    num_equity_actions = db.Column(db.Integer, nullable=False, default=0)
+    num_equity_options = db.Column(db.Integer, nullable=False, default=0)
+    deposits = db.Column(db.Float, nullable=False, default=0.0)
+    acciones_en_proceso = db.Column(db.Float, nullable=False, default=0.0)
+    total_dividends = db.Column(db.Float, nullable=False, default=0.0)
+    pl_acciones = db.Column(db.Float, nullable=False, default=0.0)
+    total_opciones_en_proceso = db.Column(db.Float, nullable=False, default=0.0)
+    total_pl_opciones = db.Column(db.Float, nullable=False, default=0.0)
+    efectivo = db.Column(db.Float, nullable=False, default=0.0)
+    computed_at = db.Column(db.DateTime, nullable=False)
+    uploaded_file = db.relationship('UploadedFile', backref=db.backref('summary', uselist=False, lazy=True))
+
+# Totales por símbolo de cada archivo (acciones y opciones sobre el subyacente)
+class SymbolSummary(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    uploaded_file_id = db.Column(db.Integer, db.ForeignKey('uploaded_file.id'), nullable=False, index=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    symbol = db.Column(db.String(64), nullable=False)
+    equity_count = db.Column(db.Integer, nullable=False, default=0)
+    stock = db.Column(db.Float, nullable=False, default=0.0)
+    income = db.Column(db.Float, nullable=False, default=0.0)
+    dividends = db.Column(db.Float, nullable=False, default=0.0)
+    option_count = db.Column(db.Integer, nullable=False, default=0)
+    option_pl = db.Column(db.Float, nullable=False, default=0.0)
+    option_dollar = db.Column(db.Float, nullable=False, default=0.0)
+    __table_args__ = (db.Index('ix_symbol_summary_user_symbol', 'user_id', 'symbol'),)